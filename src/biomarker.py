@@ -1,8 +1,12 @@
 from . import log
 from . import experiment as exp
+from . import population as pop
 from . import utility
-import scipy.signal
+from . import workspace
+import concurrent.futures
+import hashlib
 import numpy as np
+import os
 # import matplotlib.pyplot as plt # for debugging, should not be in requirements
 
 TIME = 'time'
@@ -15,114 +19,297 @@ LSARC = "Lsarc"
 CSV_SEPARATOR = ', '
 CSV_ENDLINE = '\n'
 
+DEFAULT_BEAT_COUNT = 9
+DETECTION_FULL = 'full' # beats are searched from the whole signal
+DETECTION_TAIL = 'tail' # beats are searched from the end of the signal, only as far as needed
+DETECTIONS = [DETECTION_FULL, DETECTION_TAIL]
+TAIL_CHUNK = 8192 # samples searched first in tail detection, doubled until there are enough beats
+SEGMENTATION_FILE = 'segmentation.npz' # beat tables of the cell, reused while data and detection settings stay the same
+AP_SIGNALS = [TIME, VM, STIM] # signals the tables are detected from
+CAI_SIGNALS = [TIME, CALSIUM]
+
+
+def find_peaks(x, **kwargs):
+    import scipy.signal # slow to import, and not needed before biomarkers are calculated
+    return scipy.signal.find_peaks(x, **kwargs)
+
+class BeatData:
+    '''Signals of one beat, sliced from the window data only when accessed'''
+    __slots__ = ('source', 'start', 'end')
+
+    def __init__(self, source: dict, start: int, end: int) -> None:
+        self.source = source
+        self.start = start
+        self.end = end
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        return self.source[key][self.start:self.end]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.source
+
+    def __iter__(self):
+        return iter(self.source)
+
+    def __len__(self) -> int:
+        return len(self.source)
+
+    def keys(self):
+        return self.source.keys()
+
+
+class BeatTable:
+    '''Beats of the window as index arrays.
+
+    Beat `i` is `data[start[i]:end[i]]`, and `top`, `bot` and `mcp` are relative to the beat start.
+    Beats are consecutive, so `end[i] == start[i + 1]`. Negative index means the point was not found.
+    '''
+    def __init__(self, data: dict, start: np.ndarray, end: np.ndarray) -> None:
+        self.data = data
+        self.start = start
+        self.end = end
+        self.top = np.zeros(len(start), dtype=np.int64)
+        self.bot = np.zeros(len(start), dtype=np.int64)
+        self.mcp = np.full(len(start), -1, dtype=np.int64)
+        self._beats = None
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def beats(self) -> list:
+        if self._beats is None:
+            self._beats = [Beat(self, i) for i in range(len(self.start))]
+        return self._beats
+
+    def reduce(self, ufunc: np.ufunc, key: str) -> np.ndarray:
+        # e.g. np.maximum over each beat of the signal `key`
+        signal = self.data[key][self.start[0]:self.end[-1]]
+        return ufunc.reduceat(signal, self.start - self.start[0])
+
+
 class Beat:
-    def __init__(self) -> None:
-        self.data = {}
-        self.bot_idx = 0
-        self.top_idx = 0
-        self.biomarkers = {}
+    __slots__ = ('table', 'i', 'data')
+
+    def __init__(self, table: BeatTable, i: int) -> None:
+        self.table = table
+        self.i = i
+        self.data = BeatData(table.data, table.start[i], table.end[i])
+
+    @staticmethod
+    def _index(value):
+        # Points that were not found behave like the empty result of the search
+        return value if value >= 0 else np.array([], dtype=np.int64)
+
+    @property
+    def top_idx(self):
+        return self._index(self.table.top[self.i])
+
+    @property
+    def bot_idx(self):
+        return self._index(self.table.bot[self.i])
+
+    @property
+    def mcp_idx(self):
+        if self.table.mcp[self.i] < 0:
+            raise ValueError('No minimum condition point found for the beat')
+        return self.table.mcp[self.i]
 
-class Cai_Beat:
-    def __init__(self) -> None:
-        self.data = {}
-        self.top_idx = 0
-        self.mcp_idx = 0
 
 class Window:
-    def __init__(self, original_data: dict) -> None:
+    def __init__(self, original_data: dict, biomarkers: list = [], beat_count: int = DEFAULT_BEAT_COUNT,
+                 detection: str = DETECTION_FULL) -> None:
         self.data = original_data
+        self.requested = Biomarkers.with_dependencies(biomarkers) # to calculate together what kernels can
         self.top = np.ndarray([]) # For each peak
         self.bot = np.ndarray([]) # For each peak
         self.win = {} # Our windowed data (dictionary)
         self.mdp_all = None # All minimum action potentials, ie valleys
         self.mdp = np.ndarray([]) # Minimum action potentials, ie valleys
         self.is_stimulated = False # Detected if data is stimulated
-        self._ap_beats = [] # views describing the beats based on Vm
-        self._cai_beats = [] # views describing the beats based on Cai
-        self.beat_count = 9
+        self.ap = None # BeatTable of the beats based on Vm
+        self.cai = None # BeatTable of the beats based on Cai
+        self.results = {} # biomarker values and intermediates (e.g. per beat APD) by name, computed once per window
+        self.beat_count = beat_count
+        self.detection = detection
         self.ap_bot_calculated = False
+        self.segmentation_changed = False
+
+    def segmentation_key(self, signals: list) -> str:
+        # Checksum of the signals the table is detected from, and the detection settings
+        digest = hashlib.blake2b(f'{self.beat_count} {self.detection}'.encode())
+        for name in signals:
+            if name in self.data:
+                digest.update(name.encode())
+                digest.update(np.ascontiguousarray(self.data[name], dtype=float))
+        return digest.hexdigest()
+
+    def load_segmentation(self, file: str) -> bool:
+        # Beat tables from earlier run, each if it was made from the same signals with the same settings
+        if not os.path.exists(file):
+            return False
+        try:
+            with np.load(file) as saved:
+                if 'ap_key' in saved.files and VM in self.data and str(saved['ap_key']) == self.segmentation_key(AP_SIGNALS):
+                    self.ap = BeatTable(self.data, saved['ap_start'], saved['ap_end'])
+                    self.ap.top = saved['ap_top']
+                    self.ap.bot = saved['ap_bot']
+                    self.ap_bot_calculated = bool(saved['ap_bot_calculated'])
+                    self.is_stimulated = bool(saved['is_stimulated'])
+                if 'cai_key' in saved.files and CALSIUM in self.data and str(saved['cai_key']) == self.segmentation_key(CAI_SIGNALS):
+                    self.cai = BeatTable(self.data, saved['cai_start'], saved['cai_end'])
+                    self.cai.top = saved['cai_top']
+                    self.cai.mcp = saved['cai_mcp']
+        except (OSError, ValueError, KeyError):
+            return False # broken file is made again
+        return self.ap is not None or self.cai is not None
+
+    def save_segmentation(self, file: str) -> None:
+        # Only beat tables that were found are stored, failed detections are tried again on the next run.
+        # Table not needed in this run is kept as it was, its own key tells if it is still valid
+        if not self.segmentation_changed:
+            return
+        tables = {}
+        try:
+            with np.load(file) as saved:
+                tables = {name: saved[name] for name in saved.files}
+        except (OSError, ValueError):
+            pass
+        if self.ap is not None:
+            tables.update(ap_key=np.array(self.segmentation_key(AP_SIGNALS)), ap_start=self.ap.start, ap_end=self.ap.end, ap_top=self.ap.top,
+                          ap_bot=self.ap.bot, ap_bot_calculated=self.ap_bot_calculated, is_stimulated=self.is_stimulated)
+        if self.cai is not None:
+            tables.update(cai_key=np.array(self.segmentation_key(CAI_SIGNALS)), cai_start=self.cai.start, cai_end=self.cai.end,
+                          cai_top=self.cai.top, cai_mcp=self.cai.mcp)
+        tmp_file = f'{file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, **tables)
+        os.replace(tmp_file, file)
+
+    def memo(self, name: str, function):
+        # Failures are remembered too, so biomarkers depending on a failed one fail without recomputing it
+        if name not in self.results:
+            try:
+                self.results[name] = function()
+            except Exception as error:
+                self.results[name] = error
+        result = self.results[name]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def result(self, biomarker) -> float:
+        return self.memo(str(biomarker), lambda: biomarker.calculate(self))
+
+    def together(self, biomarker, types) -> list:
+        # Requested biomarkers of `types` that are calculated in the same kernel call with `biomarker`
+        batch = [bm for bm in self.requested if isinstance(bm, types)]
+        return batch if str(biomarker) in map(str, batch) else [biomarker]
 
     def ap_beats(self) -> list:
-        if not self._ap_beats:
-            self._make_win_ap_beats()
-        return self._ap_beats
+        return self.ap_table().beats()
 
     def cai_beats(self) -> list:
-        if not self._cai_beats:
+        return self.cai_table().beats()
+
+    def ap_table(self) -> BeatTable:
+        if self.ap is None:
+            self._make_win_ap_beats()
+        return self.ap
+
+    def cai_table(self) -> BeatTable:
+        if self.cai is None:
             self._make_cai_beats()
-        return self._cai_beats
+        return self.cai
+
+    def _find_valleys(self, signal: np.ndarray, **kwargs) -> np.ndarray:
+        if self.detection == DETECTION_FULL:
+            valleys, _ = find_peaks(-signal, **kwargs)
+            return valleys
+        # Search from the end in growing chunks. The first valley of a chunk might be cut by the chunk start,
+        # so one more than needed is searched and the first is dropped
+        needed = self.beat_count + 2
+        chunk = min(len(signal), TAIL_CHUNK)
+        while True:
+            offset = len(signal) - chunk
+            valleys, _ = find_peaks(-signal[offset:], **kwargs)
+            if len(valleys) >= needed or offset == 0:
+                break
+            chunk = min(len(signal), 2 * chunk)
+        if offset > 0:
+            valleys = valleys[1:]
+        return valleys + offset
+
+    def _beat_bounds(self, valleys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # last beat_count beats defined from bottom-to-bottom, the last valley is not a start of a beat
+        if len(valleys) < self.beat_count + 1:
+            raise IndexError(f'Found {len(valleys)} valleys, {self.beat_count + 1} needed')
+        bounds = valleys[-1 - self.beat_count:]
+        return bounds[:-1], bounds[1:]
 
     def _make_win_ap_beats(self) -> None:
         # TODO add some minimum distance for the peaks (or valleys) so we don't get something weird, should depend on dt
         # TODO using 0 for threshold(ie height limit), which is arbitrary, should prob use something more meaningful
-        self.mdp_all, _ = scipy.signal.find_peaks(-self.data[VM], height=0.0)
+        self.mdp_all = self._find_valleys(self.data[VM], height=0.0)
 
         # find beats defined from bottom-to-bottom, amount described in beat_count, detected from Vm
-        for i in range(self.beat_count):
-            start_idx = self.mdp_all[-1-self.beat_count + i]
-            end_idx = self.mdp_all[-1-self.beat_count + i + 1]
-            beat = Beat()
-            for key in self.data:
-                # Make view of each data name per beat
-                beat.data[key] = self.data[key][start_idx:end_idx]
-            self._ap_beats.append(beat)
+        ap = BeatTable(self.data, *self._beat_bounds(self.mdp_all))
 
         if STIM in self.data:
-            if 1 < len(np.unique(self.data[STIM])):
+            # in tail detection, only the beats used matter
+            stim = self.data[STIM] if self.detection == DETECTION_FULL else self.data[STIM][ap.start[0]:ap.end[-1]]
+            if 1 < len(np.unique(stim)):
                 self.is_stimulated = True
 
-        for beat in self._ap_beats:
-            top_idx, _ = scipy.signal.find_peaks(beat.data[VM])
-            try:
-                beat.top_idx = top_idx[0]
-            except:
-                beat.top_idx = top_idx
+        Vm = self.data[VM]
+        for i in range(len(ap)):
+            top_idx, _ = find_peaks(Vm[ap.start[i]:ap.end[i]])
+            ap.top[i] = top_idx[0] if len(top_idx) else -1
+        self.ap = ap
+        self.segmentation_changed = True
 
     def make_ap_bot(self) -> None:
         # Only needed for APD_N, but as it is needed for each, we store these in window to avoid recalculation
         if self.ap_bot_calculated:
             return
+        ap = self.ap_table()
         self.ap_bot_calculated = True
+        self.segmentation_changed = True
 
         if self.is_stimulated:
-            for beat in self._ap_beats:
-                beat.bot_idx = np.nonzero(0 < np.diff(beat.data[STIM]))[0] + 1
+            for i in range(len(ap)):
+                rising = np.nonzero(0 < np.diff(self.data[STIM][ap.start[i]:ap.end[i]]))[0] + 1
+                # beat has to have exactly one stimulus
+                ap.bot[i] = rising[0] if len(rising) == 1 else -1
         else:
-            for beat in self._ap_beats:
-                Vm = beat.data[VM]
-                t = beat.data[TIME]
-                #In matlab code threshold was µV
-                threshold = utility.convert_to_default(-10,"uV")
-
-                DDendind = np.min(np.argwhere(Vm > threshold))
-
-                DDendtime = t[DDendind]
-                fit_window_ind = round(2*(DDendind+1)/3)
-
-                poly = np.polyfit(t[:fit_window_ind], Vm[:fit_window_ind], 1)
-                BOT = poly[0]*DDendtime+poly[1]
-                idxPertBOT = np.argwhere(t < DDendtime)
-                Vm_shorter = Vm[idxPertBOT]
-                idxBOT = np.max(np.argwhere(Vm_shorter <= BOT))
-                beat.bot_idx = idxBOT
+            #In matlab code threshold was µV
+            threshold = utility.convert_to_default(-10,"uV")
+            for i in range(len(ap)):
+                Vm = self.data[VM][ap.start[i]:ap.end[i]]
+                t = self.data[TIME][ap.start[i]:ap.end[i]]
+                try:
+                    DDendind = np.min(np.argwhere(Vm > threshold))
 
+                    DDendtime = t[DDendind]
+                    fit_window_ind = round(2*(DDendind+1)/3)
 
+                    poly = np.polyfit(t[:fit_window_ind], Vm[:fit_window_ind], 1)
+                    BOT = poly[0]*DDendtime+poly[1]
+                    idxPertBOT = np.argwhere(t < DDendtime)
+                    Vm_shorter = Vm[idxPertBOT]
+                    ap.bot[i] = np.max(np.argwhere(Vm_shorter <= BOT))
+                except (ValueError, TypeError, np.linalg.LinAlgError):
+                    ap.bot[i] = -1 # beat without depolarization
 
     def _make_cai_beats(self) -> None:
-        bot_cai_all, _ = scipy.signal.find_peaks(-self.data[CALSIUM])
-
-        for i in range(self.beat_count):
+        bot_cai_all = self._find_valleys(self.data[CALSIUM])
 
-            start_idx = bot_cai_all[-1- self.beat_count + i]
-            end_idx = bot_cai_all[-1- self.beat_count + i + 1]
-
-            cai_beat = Beat()
-            for key in self.data:
-                # Make view of each data name per beat
-                cai_beat.data[key] = self.data[key][start_idx:end_idx]
-            cai_beat.top_idx = int(np.argmax(cai_beat.data[CALSIUM]))
-            self._cai_beats.append(cai_beat)
+        cai = BeatTable(self.data, *self._beat_bounds(bot_cai_all))
+        Cai = self.data[CALSIUM]
+        for i in range(len(cai)):
+            cai.top[i] = np.argmax(Cai[cai.start[i]:cai.end[i]])
+        self.cai = cai
         self._make_MCP()
+        self.segmentation_changed = True
 
     def _make_MCP(self) ->None:
         # Soglia (from matlab) = Minimiums with a condition -> mcp = minimium condition point
@@ -130,13 +317,15 @@ class Window:
 
         threshold = 1.2
 
-        for beat in self.cai_beats():
-            cai = beat.data[CALSIUM] #start ja end on bot indexejä
+        cai_table = self.cai
+        for i in range(len(cai_table)):
+            cai = self.data[CALSIUM][cai_table.start[i]:cai_table.end[i]] #start ja end on bot indexejä
             lag_values = cai[lag:]
             now_values = cai[:-lag]
 
             location = np.argwhere(lag_values >= now_values*threshold)
-            beat.mcp_idx = location[0][0]
+            # beats without one fail only the biomarkers using it
+            cai_table.mcp[i] = location[0][0] if len(location) else -1
 
 
 class BiomarkerBase:
@@ -152,6 +341,10 @@ class BiomarkerBase:
     def optional_data(self) -> list:
         return []
 
+    def dependencies(self) -> list:
+        # Biomarkers whose values calculate uses, through window.result so that each is computed once per window
+        return []
+
     def return_type(self) -> str:
         raise NotImplementedError()
 
@@ -170,12 +363,8 @@ class Max_Cai(BiomarkerBase):
         return utility.MOLAR
 
     def calculate(self, window: Window) -> float:
-        max_cai = np.zeros(window.beat_count)
-        i = 0
-        for beat in window.cai_beats():
-            max_cai[i] = np.max(beat.data[CALSIUM])
-            i += 1
-        return np.mean(max_cai)
+        max_cai = window.cai_table().reduce(np.maximum, CALSIUM)
+        return np.mean(np.asarray(max_cai, dtype=float))
 
 
 class Min_Cai(BiomarkerBase):
@@ -189,13 +378,8 @@ class Min_Cai(BiomarkerBase):
         return utility.MOLAR
 
     def calculate(self, window: Window) -> float:
-        min_cai = np.zeros(window.beat_count)
-        i = 0
-        for beat in window.cai_beats():
-            min_cai[i] = np.min(beat.data[CALSIUM])
-            i += 1
-
-        return np.mean(min_cai)
+        min_cai = window.cai_table().reduce(np.minimum, CALSIUM)
+        return np.mean(np.asarray(min_cai, dtype=float))
 
 
 class Rate_Cai(BiomarkerBase):
@@ -209,10 +393,8 @@ class Rate_Cai(BiomarkerBase):
         return utility.FREQUENCY
 
     def calculate(self, window: Window) -> float:
-        CLCa = []
-        for beat in window.cai_beats():
-            CLCa.append(beat.data[TIME][beat.top_idx])
-        CLCa = np.diff(CLCa)
+        cai = window.cai_table()
+        CLCa = np.diff(window.data[TIME][cai.start + cai.top])
         Freq = 1/CLCa
         return Freq.mean()
 
@@ -227,9 +409,7 @@ class MDP(BiomarkerBase):
         return utility.POTENTIAL
 
     def calculate(self, window: Window) -> float:
-        all_values = np.zeros(window.beat_count)
-        for i in range(window.beat_count):
-            all_values[i] = window.ap_beats()[i].data[VM][0]
+        all_values = np.asarray(window.data[VM][window.ap_table().start], dtype=float)
         return all_values.mean()
 
 class CL(BiomarkerBase):
@@ -243,10 +423,7 @@ class CL(BiomarkerBase):
         return utility.TIME
 
     def calculate(self, window: Window) -> float:
-        cl = []
-        for beat in window.ap_beats():
-            cl.append(beat.data[TIME][0])
-        cl = np.diff(cl)
+        cl = np.diff(window.data[TIME][window.ap_table().start])
 
         return np.mean(cl)
 
@@ -276,16 +453,16 @@ class APA(BiomarkerBase):
     def required_data(self) -> list:
         return [TIME, VM]
 
+    def dependencies(self) -> list:
+        return [MDP()]
+
     def return_type(self) -> str:
         return utility.POTENTIAL
 
     def calculate(self, window: Window) -> float:
-        max = -np.inf
-        for beat in window.ap_beats():
-            beat_max = np.max(beat.data[VM])
-            if beat_max > max:
-                max = beat_max
-        return max-MDP().calculate(window)
+        beat_max = window.ap_table().reduce(np.maximum, VM)
+        max = np.max(beat_max[~np.isnan(beat_max)], initial=-np.inf)
+        return max-window.result(MDP())
 
 
 class Peak(BiomarkerBase):
@@ -299,10 +476,7 @@ class Peak(BiomarkerBase):
         return utility.POTENTIAL
 
     def calculate(self, window: Window) -> float:
-        ap_values = []
-        for beat in window.ap_beats():
-            ap_values.append(np.max(beat.data[VM]))
-
+        ap_values = window.ap_table().reduce(np.maximum, VM)
         return np.mean(ap_values)
 
 
@@ -322,23 +496,9 @@ class RTNM(BiomarkerBase):
         return utility.TIME
 
     def calculate(self, window: Window) -> float:
-        N = self.N/100
-        M = self.M/100
-        risetime = []
-
-        for beat in window.cai_beats():
-            start_index = beat.mcp_idx
-            end_index = beat.top_idx
+        return np.mean(cai_beat_values(self, window))
 
-            cai = beat.data[CALSIUM]
-            time_window = beat.data[TIME]
-            height = cai[end_index] - cai[start_index]
-            JM = np.argwhere(cai[start_index:end_index] >= cai[start_index] + M * height)[0]
-            JN = np.argwhere(cai[start_index:end_index] <= cai[start_index] + N * height)[-1]
-            time = time_window[start_index + JM] - time_window[start_index + JN]
-            risetime.append(time)
 
-        return np.mean(risetime)
 
 class DTNM(BiomarkerBase):
     def __init__(self, N: int, M: int) -> None:
@@ -356,25 +516,9 @@ class DTNM(BiomarkerBase):
         return utility.TIME
 
     def calculate(self, window: Window) -> float:
-        N = self.N/100
-        M = self.M/100
-        dectime = []
-        cai_beats = window.cai_beats()
-        for i in range(window.beat_count-1):
-            beat = cai_beats[i]
-            next_beat = cai_beats[i+1]
-            start_index = beat.top_idx
-            end_index = len(beat.data[CALSIUM])
-
-            cai = np.append(beat.data[CALSIUM], next_beat.data[CALSIUM][0])
-            t = np.append(beat.data[TIME], next_beat.data[TIME][0])
-
-            JN = np.argwhere(cai[start_index:end_index] <= cai[end_index] + N * cai[start_index])[0]
-            JM = np.argwhere(cai[start_index:end_index] >= cai[end_index] + M * cai[start_index])[-1]
-            time = t[start_index + JM] - t[start_index + JN]
-            dectime.append(time)
-
-        return np.mean(dectime)
+        return np.mean(cai_beat_values(self, window))
+
+
 
 class RTNPeak(BiomarkerBase):
     def __init__(self, N) -> None:
@@ -391,22 +535,8 @@ class RTNPeak(BiomarkerBase):
         return utility.TIME
 
     def calculate(self, window: Window) -> float:
-        N = self.N / 100
-        rtpeak = []
+        return np.mean(cai_beat_values(self, window))
 
-        for beat in window.cai_beats():
-            start_index = beat.mcp_idx
-            end_index = beat.top_idx
-
-            cai = beat.data[CALSIUM]
-            t = beat.data[TIME]
-
-            height = cai[end_index] - cai[start_index]
-            JN = np.argwhere(cai[start_index:end_index] <= cai[start_index] + N * height)[-1]
-            time = t[end_index] - t[start_index + JN]
-            rtpeak.append(time)
-
-        return np.mean(rtpeak)
 
 
 class CAI_DURATION(BiomarkerBase):
@@ -420,24 +550,8 @@ class CAI_DURATION(BiomarkerBase):
         return utility.TIME
 
     def calculate(self, window: Window) -> float:
-        cai_beats = window.cai_beats()
-        duration = []
-        for i in range(window.beat_count-1):
-            beat = cai_beats[i]
-            next_beat = cai_beats[i+1]
-
-            start_index = beat.top_idx
-            end_index = len(beat.data[CALSIUM])
-            mcp = beat.mcp_idx
+        return np.mean(cai_beat_values(self, window))
 
-            cai = np.append(beat.data[CALSIUM], next_beat.data[CALSIUM][0])
-            t = np.append(beat.data[TIME], next_beat.data[TIME][0])
-
-            mcp_otherside = start_index + np.argwhere(cai[start_index:end_index] >= cai[mcp])[-1]
-            time = t[mcp_otherside] - t[mcp]
-            duration.append(time)
-
-        return np.mean(duration)
 
 
 class MAX_DISTANCE_DIFF(BiomarkerBase):
@@ -451,11 +565,7 @@ class MAX_DISTANCE_DIFF(BiomarkerBase):
         return utility.TIME
 
     def calculate(self, window: Window) -> float:
-        times = []
-        for beat in window.ap_beats():
-            times.append(beat.data[TIME][0])
-
-        diff = np.diff(times)
+        diff = np.diff(window.data[TIME][window.ap_table().start])
         amplitude = np.max(diff)-np.min(diff)
 
         return amplitude
@@ -476,25 +586,95 @@ class CTDN(BiomarkerBase):
         return utility.TIME
 
     def calculate(self, window: Window) -> float: #TMP: Change this to match APD_N
-        ctdn = []
-        N_ = 1-self.N/100
-        cai_beats = window.cai_beats()
-
-        for i in range(window.beat_count - 1):
-            beat = cai_beats[i]
-            next_beat = cai_beats[i + 1]
-
-            start_index = beat.mcp_idx
-            end_index = len(beat.data[CALSIUM])
-
-            cai = np.append(beat.data[CALSIUM], next_beat.data[CALSIUM][0])
-            t = np.append(beat.data[TIME], next_beat.data[TIME][0])
+        return np.mean(cai_beat_values(self, window))
+
+
+def _first_last(condition: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # First and last index where condition is true in each range [lo, hi), -1 if there is none
+    count = np.concatenate(([0], np.cumsum(condition)))
+    found = count[hi] > count[lo]
+    first = np.searchsorted(count, count[lo] + 1) - 1
+    last = np.searchsorted(count, count[hi]) - 1
+    return np.where(found, first, -1), np.where(found, last, -1)
+
+
+def cai_kernel(window: Window, biomarkers: list) -> dict:
+    '''Per beat values of the calcium transient biomarkers (RTNM, DTNM, RTNPeak, CTDN and CAI_DURATION).
+
+    Returns values and which of them could be determined, by biomarker name. Indices are from
+    the start of the first beat, and as beats are consecutive, the first point of the next beat
+    is the end of the beat. Biomarkers needing the next beat have one value less than there are beats.
+    '''
+    table = window.cai_table()
+    first_idx = table.start[0]
+    # the first point of the beat after the last is not needed, as the last beat has no next beat
+    cai = window.data[CALSIUM][first_idx:table.end[-1]]
+    t = window.data[TIME][first_idx:table.end[-1]]
+    start = table.start - first_idx
+    end = table.end - first_idx
+    beat_of = np.repeat(np.arange(len(table)), end - start)
+    top = start + table.top
+    has_mcp = table.mcp >= 0
+    mcp = start + np.where(has_mcp, table.mcp, 0)
+    # beats having the next beat
+    top_next = top[:-1]
+    end_next = end[:-1]
+    mcp_next = mcp[:-1]
+
+    def per_point(value: np.ndarray) -> np.ndarray:
+        # beat value to each point of the beat, the last beat gets the previous value when value is only for beats having the next
+        return value[np.minimum(beat_of, len(value) - 1)]
+
+    results = {}
+    for bm in biomarkers:
+        if isinstance(bm, RTNM):
+            N = bm.N/100
+            M = bm.M/100
+            height = cai[top] - cai[mcp]
+            JM, _ = _first_last(cai >= per_point(cai[mcp] + M * height), mcp, top)
+            _, JN = _first_last(cai <= per_point(cai[mcp] + N * height), mcp, top)
+            found = has_mcp & (JM >= 0) & (JN >= 0)
+            results[str(bm)] = (t[JM] - t[JN], found)
+        elif isinstance(bm, RTNPeak):
+            N = bm.N / 100
+            height = cai[top] - cai[mcp]
+            _, JN = _first_last(cai <= per_point(cai[mcp] + N * height), mcp, top)
+            found = has_mcp & (JN >= 0)
+            results[str(bm)] = (t[top] - t[JN], found)
+        elif isinstance(bm, DTNM):
+            N = bm.N/100
+            M = bm.M/100
+            # levels are relative to the next beat start, scaled by the peak
+            reference = cai[end_next]
+            JN, _ = _first_last(cai <= per_point(reference + N * cai[top_next]), top_next, end_next)
+            _, JM = _first_last(cai >= per_point(reference + M * cai[top_next]), top_next, end_next)
+            found = (JM >= 0) & (JN >= 0)
+            results[str(bm)] = (t[JM] - t[JN], found)
+        elif isinstance(bm, CAI_DURATION):
+            # mcp level crossed again after the peak
+            _, otherside = _first_last(cai >= per_point(cai[mcp_next]), top_next, end_next)
+            found = has_mcp[:-1] & (otherside >= 0)
+            results[str(bm)] = (t[otherside] - t[mcp_next], found)
+        elif isinstance(bm, CTDN):
+            N_ = 1-bm.N/100
+            nonempty = mcp_next < end_next
+            bounds = np.stack([mcp_next, end_next], axis=1).ravel()
+            peak = np.maximum.reduceat(cai, np.minimum(bounds, len(cai) - 1))[::2] - cai[mcp_next]
+            first, last = _first_last(cai >= per_point(cai[mcp_next] + N_*peak), mcp_next, end_next)
+            found = has_mcp[:-1] & nonempty & (first >= 0)
+            results[str(bm)] = (t[last] - t[first], found)
+        else:
+            raise ValueError(f'Biomarker `{bm}` is not calculated with calcium transient kernel')
+    return results
 
-            height = np.argwhere(cai[start_index:end_index] >= cai[start_index] + N_*(np.max(cai[start_index:end_index] - cai[start_index])))
-            time = t[start_index+height[-1]] - t[start_index+height[0]]
-            ctdn.append(time)
 
-        return np.mean(ctdn)
+def cai_beat_values(biomarker, window: Window) -> np.ndarray:
+    batch = window.together(biomarker, (RTNM, DTNM, RTNPeak, CTDN, CAI_DURATION))
+    results = window.memo(f'Cai transient {[str(bm) for bm in batch]} per beat', lambda: cai_kernel(window, batch))
+    values, found = results[str(biomarker)]
+    if not found.all():
+        raise ValueError(f'{biomarker} could not be determined for every beat')
+    return values
 
 
 class APD_N(BiomarkerBase):
@@ -516,46 +696,60 @@ class APD_N(BiomarkerBase):
         return utility.TIME
 
     def calculate(self, window: Window) -> float:
-        def vector_point_calc(b: Beat, h1, h2, value) -> float:
-            x1 =np.array([b.data[TIME][h1], b.data[VM][h1]])
-            x2 = np.array([b.data[TIME][h2], b.data[VM][h2]])
-
-            vec = x2-x1
-            k = (value-x1[1])/vec[1]
-            vec2 = k*vec
-            return x1[0] + vec2[0]
-
-        window.make_ap_bot() # Ensure that we have bot idx
-        all_values = np.zeros(window.beat_count)
-        i = 0
-        beat: Beat
-        for beat in window.ap_beats():
-            top = beat.data[VM][beat.top_idx]
-            bot = beat.data[VM][beat.bot_idx]
-
-            # Scale to N% from the top
-            value_height = ((1 - self.N/100) * (top-bot)) + bot
-
-            # Two values at given height, (start and end)
-            at_height = np.argwhere(beat.data[VM] > value_height).ravel()
-            all_values[i] = beat.data[TIME][at_height[-1]] - beat.data[TIME][at_height[0]]
-            t0 = vector_point_calc(beat, at_height[0]-1, at_height[0], value_height)
-            t1 = vector_point_calc(beat, at_height[-1], at_height[-1]+1, value_height)
-            all_values[i] = t1-t0
-            beat.biomarkers[str(self)] = all_values[i]
-            i += 1
-
-
-            # Debug log.print_infoing if you want to check what is actually happening
-            # plt.plot(beat.data[TIME],beat.data[VM])
-            # plt.plot(beat.data[TIME][beat.bot_idx], beat.data[VM][beat.bot_idx], 'x')
-            # plt.plot(beat.data[TIME][beat.top_idx], beat.data[VM][beat.top_idx], 'o')
-
-            # plt.plot([t0, t1], [value_height, value_height])
-            # plt.show()
-            #In matlab it takes maximium peak and we take first peak
-
-        return all_values.mean()
+        return self.beat_values(window).mean()
+
+    def beat_values(self, window: Window) -> np.ndarray:
+        levels = sorted({bm.N for bm in window.together(self, APD_N)})
+        values, found = window.memo(f'APD{levels} per beat', lambda: apd_kernel(window, levels))
+        row = levels.index(self.N)
+        if not found[row].all():
+            raise ValueError(f'{self} could not be determined for every beat')
+        return values[row]
+
+
+def apd_kernel(window: Window, levels: list) -> tuple[np.ndarray, np.ndarray]:
+    '''Action potential durations of every beat at every level, shape (levels, beats).
+
+    Durations are between the first and last point above the level, interpolated linearly
+    to the level from the previous and the next point. Second array tells which durations
+    could be determined, i.e. the beat has top, bottom and points above the level.
+    '''
+    window.make_ap_bot() # Ensure that we have bot idx
+    ap = window.ap_table()
+    first_idx = ap.start[0]
+    Vm = window.data[VM][first_idx:ap.end[-1]]
+    t = window.data[TIME][first_idx:ap.end[-1]]
+    start = ap.start - first_idx
+    end = ap.end - first_idx
+
+    found = (ap.top >= 0) & (ap.bot >= 0)
+    top = Vm[start + np.where(found, ap.top, 0)]
+    bot = Vm[start + np.where(found, ap.bot, 0)]
+    # Scale to N% from the top, one row per level
+    factor = np.array([[1 - N/100] for N in levels])
+    value_height = (factor * (top-bot)) + bot
+
+    # First and last point above the level in each beat
+    beat_of = np.repeat(np.arange(len(ap)), end - start)
+    above = Vm > value_height[:, beat_of]
+    index = np.arange(len(Vm))
+    first = np.minimum.reduceat(np.where(above, index, len(Vm)), start, axis=1)
+    last = np.maximum.reduceat(np.where(above, index, -1), start, axis=1)
+    # the point after the last has to be in the same beat
+    found = found & (last >= 0) & (last + 1 < end)
+    first = np.where(found, first, start)
+    last = np.where(found, last, start)
+
+    def crossing(h1, h2):
+        # time where line through points h1 and h2 is at value_height
+        k = (value_height - Vm[h1]) / (Vm[h2] - Vm[h1])
+        return t[h1] + k * (t[h2] - t[h1])
+
+    # point before the first of the beat wraps to the last point of the beat, like negative index would
+    before_first = np.where(first == start, end - 1, first - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        durations = crossing(last, last + 1) - crossing(before_first, first)
+    return durations, found
 
 
 class Rate_AP(BiomarkerBase):
@@ -565,39 +759,103 @@ class Rate_AP(BiomarkerBase):
     def required_data(self) -> list:
         return [TIME, VM]
 
+    def dependencies(self) -> list:
+        return [CL()]
+
     def return_type(self) -> str:
         return utility.FREQUENCY
 
     def calculate(self, window: Window) -> float:
-        return 1/CL().calculate(window)
+        return 1/window.result(CL())
 
 class RAPP_APD(BiomarkerBase):
+    def __init__(self, mean_first_beat: list = []) -> None:
+        # APD levels where the first beat uses mean of all beats, as versions before per-beat APDs did
+        super().__init__()
+        self.mean_first_beat = mean_first_beat
+
     def __str__(self) -> str:
         return 'RAPP_APD'
 
     def required_data(self) -> list:
         return [TIME, VM]
 
+    def dependencies(self) -> list:
+        return [APD_N(30), APD_N(40), APD_N(70), APD_N(80)]
+
     def return_type(self) -> str:
         return utility.UNITLESS
 
     def calculate(self, window: Window) -> float: #toimii
-        values = []
-        def get_ap(win: Window, N: int):
-            name = str(APD_N(N))
-            if str(name) in beat.biomarkers:
-                return beat.biomarkers[name]
-            else:
-                return APD_N(N).calculate(win)
-        for beat in window.ap_beats():
-            apd30 = get_ap(window, 30)
-            apd40 = get_ap(window, 40)
-            apd70 = get_ap(window, 70)
-            apd80 = get_ap(window, 80)
-            values.append((apd30-apd40)/(apd70-apd80))
-
+        apd30, apd40, apd70, apd80 = [RAPP_APD._first_beat(apd.beat_values(window), apd.N in self.mean_first_beat)
+                                      for apd in self.dependencies()]
+        values = (apd30-apd40)/(apd70-apd80)
         return np.mean(values)
 
+    @staticmethod
+    def _first_beat(values: np.ndarray, mean: bool) -> np.ndarray:
+        if not mean:
+            return values
+        values = values.copy()
+        values[0] = values.mean()
+        return values
+
+    @staticmethod
+    def legacy(configured: list) -> 'RAPP_APD':
+        # Earlier versions used mean APDs for the first beat, unless the APD was configured before RAPP_APD
+        return RAPP_APD([apd.N for apd in RAPP_APD().dependencies() if str(apd) not in configured])
+
+def beat_peaks(window: Window, key: str, sign: float = 1.0) -> np.ndarray:
+    '''Indices of the peaks (valleys with sign -1) of signal `key` inside the AP beats.
+
+    Peaks are searched once from all beats, and the ones at beat edges dropped,
+    as those would not be peaks of the beat alone.
+    '''
+    def find() -> np.ndarray:
+        ap = window.ap_table()
+        first_idx = ap.start[0]
+        locs, _ = find_peaks(sign * window.data[key][first_idx:ap.end[-1]])
+        locs = locs + first_idx
+        beat = np.searchsorted(ap.start, locs, side='right') - 1
+        inside = (locs != ap.start[beat]) & (locs != ap.end[beat] - 1)
+        return locs[inside]
+    return window.memo(f'{key} {"peaks" if sign > 0 else "valleys"}', find)
+
+
+def contraction_kernel(window: Window) -> tuple[np.ndarray, np.ndarray]:
+    '''Time from the force peak to half relaxation, for each beat having the next beat.
+
+    Force peak is searched from the Vm peak of the beat to the point before the Vm peak of the next beat,
+    and the half relaxation is where force first goes to half of the peak after it, interpolated linearly.
+    Returns values and which of them could be determined.
+    '''
+    ap = window.ap_table()
+    first_idx = ap.start[0]
+    force = window.data[FORCE][first_idx:ap.end[-1]]
+    t = window.data[TIME][first_idx:ap.end[-1]]
+    start = ap.start - first_idx
+    lo = start[:-1] + ap.top[:-1]
+    hi = start[1:] + ap.top[1:] - 1
+    found = (ap.top[:-1] >= 0) & (ap.top[1:] >= 0) & (lo < hi)
+    lo = np.where(found, lo, 0)
+    hi = np.where(found, hi, 1)
+
+    # ranges [lo, hi) are in order and do not overlap
+    range_of = np.clip(np.searchsorted(lo, np.arange(len(force)), side='right') - 1, 0, len(lo) - 1)
+    bounds = np.stack([lo, hi], axis=1).ravel()
+    peak = np.maximum.reduceat(force, np.minimum(bounds, len(force) - 1))[::2]
+    peak_idx, _ = _first_last(force == peak[range_of], lo, hi)
+    half = 0.5 * peak
+    after = np.where(peak_idx >= 0, peak_idx + 1, hi)
+    crossing, _ = _first_last(force <= half[range_of], after, hi)
+    found = found & (peak_idx >= 0) & (crossing >= 0)
+    crossing = np.where(found, crossing, 1)
+    before = crossing - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        half_time = t[before] + (half - force[before]) * (t[crossing] - t[before]) / (force[crossing] - force[before])
+    return half_time - t[peak_idx], found
+
+
 class peakTension(BiomarkerBase):
     def __str__(self) -> str:
         return 'peakTension'
@@ -609,13 +867,7 @@ class peakTension(BiomarkerBase):
         return utility.FORCE_PER_AREA
 
     def calculate(self, window: Window) -> float:
-        maxtension = []
-        for beat in window.ap_beats():
-            force = beat.data[FORCE]
-            locs, _ = scipy.signal.find_peaks(force)
-            values = force[locs]
-            maxtension = np.concatenate((maxtension, values))
-
+        maxtension = window.data[FORCE][beat_peaks(window, FORCE)]
         return np.mean(maxtension)
 
 class cellShortPerc(BiomarkerBase):
@@ -629,16 +881,9 @@ class cellShortPerc(BiomarkerBase):
         return utility.UNITLESS
 
     def calculate(self, window: Window) -> float:
-        cellshort = []
-        max_Lsarc = -np.inf
-        for beat in window.ap_beats():
-            Lsarc = beat.data[LSARC]
-            locs, _ = scipy.signal.find_peaks(-Lsarc)
-            values = Lsarc[locs]
-            cellshort = np.concatenate((cellshort, values))
-
-            if np.max(Lsarc) > max_Lsarc:
-                max_Lsarc = np.max(Lsarc)
+        cellshort = window.data[LSARC][beat_peaks(window, LSARC, -1.0)]
+        beat_max = window.ap_table().reduce(np.maximum, LSARC)
+        max_Lsarc = np.max(beat_max[~np.isnan(beat_max)], initial=-np.inf)
 
         Cellshort = np.mean(cellshort)
         cellshortperc = 100*Cellshort/max_Lsarc
@@ -655,60 +900,11 @@ class relaxTime50(BiomarkerBase):
         return utility.TIME
 
     def calculate(self, window: Window) -> float:
-        relaxTime50Buf = np.zeros(window.beat_count-1)
-        i = 0
-
-        stepTol = utility.convert_to_default(0.5e-4, "mN/mm2")
-        maxTol = utility.convert_to_default(5e-4, "mN/mm2")
-        minTol = utility.convert_to_default(1e-4, "mN/mm2")
-
-
-        for beat_idx in range(window.beat_count-1):
-            beat = window.ap_beats()[beat_idx]
-            next_beat = window.ap_beats()[beat_idx+1]
-            t = np.concatenate((beat.data[TIME], next_beat.data[TIME]))
-            frc = np.concatenate((beat.data[FORCE], next_beat.data[FORCE]))
-            top = beat.top_idx
-
-            next_top = next_beat.top_idx+len(beat.data[TIME])-1
-
-            relaxTime50Buf[i] = self.computeContrRT50(t, t[top], t[next_top], frc, minTol, maxTol, stepTol)
-
-
-            i += 1
+        relaxTime50Buf, found = window.memo(f'{self} per beat', lambda: contraction_kernel(window))
+        if not found.all():
+            raise ValueError(f'{self} could not be determined for every beat')
         return np.mean(relaxTime50Buf)
 
-    def computeContrRT50(self, t, tStartRT50, tStopRT50, Frc, min, max, step) -> float:
-        min_tol = min
-        max_tol = max
-        step_tol = step
-
-        tt = np.argwhere((tStartRT50 <= t) & (t <= tStopRT50))
-        ts = tt[0][0]
-        te = tt[-1][0]
-        tlc = t[ts:te]
-        frct = Frc[ts:te]
-        pkt = np.max(frct)
-        ppp = np.argmax(frct)
-        pkt_time = tlc[ppp]
-
-        count = 0
-
-        rel50 = []
-        while min_tol <= max_tol:
-            min_tol = min_tol + step_tol*count
-            rel50 = np.argwhere(np.abs(frct[ppp:]-0.5*pkt)<=min_tol)
-            if len(rel50) >= 1:
-                rel50 = rel50[0]
-                break
-            count +=1
-        halfreltime = tlc[ppp + rel50]
-        RT50 = (halfreltime - pkt_time)
-
-
-
-        return RT50
-
 BIOMARKERS = {'MDP': MDP(),
               'Max_Cai': Max_Cai(),
               'Min_Cai': Min_Cai(),
@@ -743,11 +939,58 @@ BIOMARKERS = {'MDP': MDP(),
               }
 
 
+def cell_values(biomarkers: list, beat_count: int, detection: str, source,
+                names_required: list, names_optional: list, segmentation: bool, idx: int, skip: list = []) -> list:
+    # Biomarkers of one cell in default units, nan for those that could not be found. Source is experiment or population.
+    # Biomarkers at indices `skip` are not calculated, their value is None
+    if len(skip) == len(biomarkers):
+        return [None] * len(biomarkers)
+    wanted = [bm for i, bm in enumerate(biomarkers) if i not in skip]
+    data = Window(source.get_data(names_required, names_optional, idx), wanted, beat_count, detection)
+    segmentation_file = f'{source.get_directory(idx)}/{SEGMENTATION_FILE}'
+    if segmentation:
+        data.load_segmentation(segmentation_file)
+    values = []
+    for i, bm in enumerate(biomarkers):
+        if i in skip:
+            values.append(None)
+            continue
+        try:
+            values.append(data.result(bm))
+        except:
+            values.append(float('nan'))
+    if segmentation:
+        data.save_segmentation(segmentation_file)
+    return values
+
+
+_job = None # arguments of cell_values shared by all cells, set once in each biomarker process
+
+
+def start_job(*args) -> None:
+    global _job
+    _job = args
+
+
+def job_values(idx: int, skip: list = []) -> list:
+    return cell_values(*_job, idx, skip)
+
+
+def read_results(file_name: str) -> list:
+    # Rows of biomarker file as lists of strings, header first
+    with open(file_name, 'r') as file:
+        return [line.rstrip(CSV_ENDLINE).split(CSV_SEPARATOR) for line in file if line.strip()]
+
+
 class Biomarkers:
     def __init__(self, args, patch_idx: int, patch_count: int) -> None:
         self.target = args[0]['target']
         self.file = args[0]['file']
         self.patch_file = utility.append_patch(self.file, patch_idx, patch_count)
+        self.beat_count, self.detection = Biomarkers.detection_settings(args[0])
+        self.jobs = args[0]['jobs'] if 'jobs' in args[0] else 1
+        self.shared_population = args[0]['shared_population'] if 'shared_population' in args[0] else False
+        self.segmentation = args[0]['segmentation_sidecar'] if 'segmentation_sidecar' in args[0] else False
         self.biomarkers = []
         self.biomarker_units = {}
         for i in range(1,len(args)):
@@ -759,17 +1002,43 @@ class Biomarkers:
 
             if not bio in BIOMARKERS:
                 raise ValueError(f'Unrecognized biomarker `{bio}`')
-            self.biomarkers.append(BIOMARKERS[bio])
+            if bio == 'RAPP_APD' and 'legacy_first_beat' in args[i] and args[i]['legacy_first_beat']:
+                self.biomarkers.append(RAPP_APD.legacy([str(bm) for bm in self.biomarkers]))
+            else:
+                self.biomarkers.append(BIOMARKERS[bio])
             self.biomarker_units[bio] = unit
 
+    @staticmethod
+    def detection_settings(args: dict) -> tuple[int, str]:
+        beat_count = args['beat_count'] if 'beat_count' in args else DEFAULT_BEAT_COUNT
+        detection = args['beat_detection'] if 'beat_detection' in args else DETECTION_FULL
+        if beat_count < 2:
+            raise ValueError(f'beat_count must be at least 2, was `{beat_count}`')
+        if detection not in DETECTIONS:
+            raise ValueError(f'Unknown beat_detection `{detection}`, expected one of {DETECTIONS}')
+        return beat_count, detection
+
     def __str__(self) -> str:
         bio_str = ' , '.join(map(str, list(map(type, self.biomarkers))))
         return f'target: {self.target} | file: {self.file}| {bio_str}'
 
+    @staticmethod
+    def with_dependencies(biomarkers) -> list:
+        # Biomarkers and everything they depend on, dependencies first
+        full = []
+        def add(bm) -> None:
+            for dependency in bm.dependencies():
+                add(dependency)
+            if str(bm) not in map(str, full):
+                full.append(bm)
+        for bm in biomarkers:
+            add(bm)
+        return full
+
     @staticmethod
     def required_data_full(biomarkers) -> list:
         required_data = []
-        for bm in biomarkers:
+        for bm in Biomarkers.with_dependencies(biomarkers):
             for data_name in bm.required_data():
                 if data_name not in required_data:
                     required_data.append(data_name)
@@ -778,7 +1047,7 @@ class Biomarkers:
     @staticmethod
     def optional_data_full(biomarkers) -> list:
         optional_data = []
-        for bm in biomarkers:
+        for bm in Biomarkers.with_dependencies(biomarkers):
             for data_name in bm.optional_data():
                 if data_name not in optional_data:
                     optional_data.append(data_name)
@@ -792,47 +1061,127 @@ class Biomarkers:
         log.print_info(f'Using experiment: `{experiment}`')
         log.print_info(f'Would write to file: `{self.file}`')
 
-    def run(self, experiment: exp.Experiment) -> None:
-        # Collect list of all needed data from biomarkers
-        names_required = Biomarkers.required_data_full(self.biomarkers)
-        names_optional = Biomarkers.optional_data_full(self.biomarkers)
-        header = [str(bm)+f" ({self.biomarker_units[str(bm)]})" for bm in self.biomarkers]
-        all_results = []
-        # get data through the experiment needed for the biomarkers
-        for idx in experiment.patch:
-            # get data through the experiment needed for the biomarkers
-            data = Window(experiment.get_data(names_required, names_optional, idx))
-            results = ['nan'] * len(self.biomarkers)
-            for i in range(len(self.biomarkers)):
-                try:
-                    value = self.biomarkers[i].calculate(data)
-                except:
-                    value = float('nan')
-                unit = self.biomarker_units[str(self.biomarkers[i])]
-                type = self.biomarkers[i].return_type()
-                if unit == utility.DEFAULT:
-                    unit = utility.default_option[type]
-                    self.biomarker_units[str(self.biomarkers[i])] = unit
-                    header[i] = str(self.biomarkers[i])+f" ({unit})"
-                try:
-                    results[i] = str(utility.convert_from_default(value, unit))
-                except:
-                    raise KeyError(f"We do not support the requested biomarker unit '{unit}'. We support units: {list(utility.unit_to_scimath.keys())}")
-
-            # Remove following comments to log.print_info out biomarkers for each cell
-            #for bm, result in zip(self.biomarkers, results):
-            #    log.print_info(f"{str(bm)}: {result} {self.biomarker_units[str(bm)]}")
-
+    def setup(self) -> None:
+        # Needed data and units of the results, resolved once before any cell
+        self.names_required = Biomarkers.required_data_full(self.biomarkers)
+        self.names_optional = Biomarkers.optional_data_full(self.biomarkers)
+        self.units = []
+        for bm in self.biomarkers:
+            if self.biomarker_units[str(bm)] == utility.DEFAULT:
+                self.biomarker_units[str(bm)] = utility.default_option[bm.return_type()]
+            self.units.append(self.biomarker_units[str(bm)])
+        self.header = [str(bm)+f" ({unit})" for bm, unit in zip(self.biomarkers, self.units)]
+
+    def process_count(self, experiment: exp.Experiment) -> int:
+        if self.jobs < 1:
+            raise ValueError(f"Biomarker jobs must be at least one (was `{self.jobs}`)")
+        return self.jobs
+
+    def job(self, source) -> tuple:
+        # Arguments of cell_values, except the cell index
+        return (self.biomarkers, self.beat_count, self.detection, source, self.names_required, self.names_optional, self.segmentation)
+
+    def format(self, values: list) -> list:
+        results = []
+        for value, unit in zip(values, self.units):
+            if value is None:
+                results.append(None) # not calculated
+                continue
+            try:
+                results.append(str(utility.convert_from_default(value, unit)))
+            except:
+                raise KeyError(f"We do not support the requested biomarker unit '{unit}'. We support units: {list(utility.unit_to_scimath.keys())}")
+        return results
+
+    def write_cell(self, experiment: exp.Experiment, idx: int, results: list) -> None:
+        file_name = f'{experiment.get_directory(idx)}/{self.file}'
+        workspace.unshare(file_name)
+        with open(file_name, 'w') as file:
+            file.write(CSV_SEPARATOR.join(self.header) + CSV_ENDLINE)
+            file.write(CSV_SEPARATOR.join(results) + CSV_ENDLINE)
 
-            all_results.append(results)
+    def patch_header(self) -> str:
+        return CSV_SEPARATOR.join(['directory'] + self.header) + CSV_ENDLINE
+
+    def patch_line(self, experiment: exp.Experiment, idx: int, results: list) -> str:
+        return experiment.get_id(idx) + CSV_SEPARATOR + CSV_SEPARATOR.join(results) + CSV_ENDLINE
+
+    def existing_results(self, experiment: exp.Experiment) -> dict:
+        # Earlier results of the cells as {column: value}, for cells whose model outputs are not newer than the results.
+        # Cell file is used when there is one, otherwise the row of the patch file
+        rows = {}
+        patch_file = f'{experiment.cwd}/{self.patch_file}'
+        if os.path.exists(patch_file):
+            header, *lines = read_results(patch_file)
+            for line in lines:
+                rows[line[0]] = (dict(zip(header[1:], line[1:])), os.path.getmtime(patch_file))
+        existing = {}
+        for idx in experiment.patch:
             file_name = f'{experiment.get_directory(idx)}/{self.file}'
-            file = open(file_name, 'w')
-            file.write(CSV_SEPARATOR.join(header) + CSV_ENDLINE)
-            file.write(CSV_SEPARATOR.join(results) + CSV_ENDLINE)
+            if os.path.exists(file_name) and len(read_results(file_name)) == 2:
+                header, line = read_results(file_name)
+                columns, mtime = dict(zip(header, line)), os.path.getmtime(file_name)
+            elif experiment.get_id(idx) in rows:
+                columns, mtime = rows[experiment.get_id(idx)]
+            else:
+                continue
+            outputs_mtime = experiment.model.outputs_mtime(experiment.get_directory(idx))
+            if outputs_mtime != None and outputs_mtime > mtime:
+                log.print_verbose(f'Model outputs of `{experiment.get_id(idx)}` are newer than its biomarkers, all are calculated again')
+                continue
+            existing[idx] = columns
+        return existing
+
+    def run(self, experiment: exp.Experiment, incremental: bool = False) -> None:
+        self.setup()
+        # In incremental run, columns found with the same name and unit are not calculated again,
+        # and the columns of biomarkers not in the config are kept. Files have the union of the columns.
+        # Column of a configured biomarker in other unit is dropped, calibration finds the columns by name
+        existing = self.existing_results(experiment) if incremental else {}
+        configured = self.header
+        names = [str(bm) for bm in self.biomarkers]
+        extra = []
+        for columns in existing.values():
+            extra += [name for name in columns if name not in configured and name not in extra and name.split('(')[0].strip() not in names]
+        self.header = configured + extra
+        skips = {idx: [i for i, name in enumerate(configured) if name in existing.get(idx, {})] for idx in experiment.patch}
+
+        jobs = self.process_count(experiment)
+        source = experiment
+        if jobs > 1 and self.shared_population:
+            source = pop.Population.load(experiment, self.names_required, self.names_optional, TIME, jobs) or experiment
+        executor = None
+        if jobs > 1:
+            # Cells are analysed in other processes, results come back in cell order and files are written here
+            executor = concurrent.futures.ProcessPoolExecutor(jobs, initializer=start_job, initargs=self.job(source))
+            patch_values = executor.map(job_values, experiment.patch, [skips[idx] for idx in experiment.patch],
+                                        chunksize=max(1, len(experiment.patch) // (4 * jobs)))
+        else:
+            patch_values = (cell_values(*self.job(source), idx, skips[idx]) for idx in experiment.patch)
+
+        all_results = []
+        try:
+            for idx, values in zip(experiment.patch, patch_values):
+                results = self.format(values)
+                if incremental:
+                    columns = existing.get(idx, {})
+                    results = [columns[name] if result == None else result for name, result in zip(configured, results)]
+                    results += [columns.get(name, 'nan') for name in extra]
+
+                # Remove following comments to log.print_info out biomarkers for each cell
+                #for bm, result in zip(self.biomarkers, results):
+                #    log.print_info(f"{str(bm)}: {result} {self.biomarker_units[str(bm)]}")
+
+                all_results.append(results)
+                self.write_cell(experiment, idx, results)
+                experiment.biomarkers_done(idx, self.names_required, self.names_optional)
+        finally:
+            if executor != None:
+                executor.shutdown(cancel_futures=True)
+            if source != experiment:
+                source.close()
         file_name = f'{experiment.cwd}/{self.patch_file}'
-        file = open(file_name, 'w')
-        file.write(CSV_SEPARATOR.join(['directory'] + header) + CSV_ENDLINE)
-        idx = experiment.patch.start
-        for res in all_results:
-            file.write(experiment.get_id(idx) + CSV_SEPARATOR + CSV_SEPARATOR.join(res) + CSV_ENDLINE)
-            idx += 1
+        with open(file_name, 'w') as file:
+            file.write(self.patch_header())
+            for idx, results in zip(experiment.patch, all_results):
+                file.write(self.patch_line(experiment, idx, results))
@@ -0,0 +1,126 @@
+from . import log
+from . import workspace
+import hashlib
+import os
+import pathlib
+import shutil
+import stat
+import tempfile
+
+SIZE_UNITS = {'B': 1, 'KB': 1e3, 'MB': 1e6, 'GB': 1e9, 'TB': 1e12}
+
+
+def parse_size(size) -> int:
+    # Either number of bytes, or string like "10GB"
+    if isinstance(size, (int, float)):
+        return int(size)
+    text = str(size).strip().upper()
+    for unit in sorted(SIZE_UNITS, key=len, reverse=True):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * SIZE_UNITS[unit])
+    return int(float(text))
+
+
+def directory_digest(directory) -> str:
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, directory).encode())
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def make_read_only(directory) -> None:
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if not os.path.islink(path):
+                os.chmod(path, os.stat(path).st_mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+def directory_size(directory) -> int:
+    size = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            size += os.lstat(os.path.join(root, name)).st_size
+    return size
+
+
+class ResultCache:
+    '''Model output directories stored by key, shared between experiments and optimizations.
+
+    Layout is `<directory>/entries/<key>` for the outputs and `<directory>/used/<key>`,
+    which holds size of the entry and whose modification time tells when the entry was last used.
+    Entries are copies made read-only, fetched cells hardlink to them and must not write their files in place (see `workspace.unshare`).
+    '''
+    def __init__(self, directory: str, max_size) -> None:
+        self.directory = pathlib.Path(directory)
+        self.max_size = parse_size(max_size)
+        self.entries = self.directory / 'entries'
+        self.used = self.directory / 'used'
+        self.tmp = self.directory / 'tmp'
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def fetch(self, key: str, current_wd) -> bool:
+        entry = self.entries / key
+        if not entry.is_dir():
+            return False
+        shutil.rmtree(current_wd, ignore_errors=True)
+        try:
+            shutil.copytree(entry, current_wd, symlinks=True, copy_function=workspace.link_or_copy)
+        except (OSError, shutil.Error):
+            # e.g. evicted by someone else while we were linking, then we just run the model
+            shutil.rmtree(current_wd, ignore_errors=True)
+            return False
+        try:
+            os.utime(self.used / key)
+        except OSError:
+            pass
+        log.print_verbose(f'Cache hit for `{current_wd}`')
+        return True
+
+    def store(self, key: str, current_wd) -> None:
+        entry = self.entries / key
+        if entry.is_dir():
+            return
+        for directory in [self.entries, self.used, self.tmp]:
+            directory.mkdir(parents=True, exist_ok=True)
+        tmp = pathlib.Path(tempfile.mkdtemp(dir=self.tmp))
+        try:
+            # copy, model or user may still modify the cell directory it was stored from
+            shutil.copytree(current_wd, tmp / key, symlinks=True)
+            make_read_only(tmp / key)
+            # rename is atomic, so concurrent runs of the same cell do not see half made entries
+            os.rename(tmp / key, entry)
+        except OSError:
+            pass # someone else stored it first
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        (self.used / key).write_text(str(directory_size(entry)))
+        self.evict()
+
+    def evict(self) -> None:
+        used = []
+        for path in self.used.iterdir():
+            try:
+                used.append((path.stat().st_mtime, int(path.read_text()), path.name))
+            except (OSError, ValueError):
+                continue
+        total = sum(size for _, size, _ in used)
+        for _, size, key in sorted(used):
+            if total <= self.max_size:
+                break
+            log.print_verbose(f'Cache evict `{key}`')
+            shutil.rmtree(self.entries / key, ignore_errors=True)
+            try:
+                os.remove(self.used / key)
+            except OSError:
+                pass
+            total -= size
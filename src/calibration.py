@@ -174,6 +174,7 @@ class Protocol:
 
 class Calibration:
     def __init__(self, args, experiment: exp.Experiment, patch_idx: int, patch_count: int) -> None:
+        self.experiment = experiment
         self.biomarker_file = f"{experiment.cwd}/{utility.append_patch(args[0]['file'], patch_idx, patch_count)}"
         self.protocols = []
         for arg in args[1:]:
@@ -182,32 +183,42 @@ class Calibration:
     def __str__(self) -> str:
         return 'No printing in calibration, sorry'
 
+    def setup(self, header_row: list) -> list:
+        # Parse biomarker header, e.g. ['directory', ' APD90 (ms)'], protocols get the units. Returns the names
+        header = []
+        units = {}
+        for val in header_row:
+            if "(" not in val:
+                header.append(val)
+                continue
+            val = val.strip()
+            name, unit = val.split("(")
+            name = name.strip()
+            units[name] = unit[:-1].strip()
+            header.append(name)
+        for protocol in self.protocols:
+            protocol.setup_data()
+            protocol.biomarker_units = units
+        return header
+
+    def run_row(self, header: list, line: list) -> bool:
+        # True if cell passes all protocols
+        for protocol in self.protocols:
+            looks = {header[0]: line[0]} #line 0 is str but others need to be a floating point
+            for name, value in zip(header[1:], line[1:]):
+                looks[name] = float(value)
+
+            if not protocol.run(looks):
+                return False
+        return True
+
     def run(self) -> None:
         with open(self.biomarker_file) as csvfile: # in example (biomarkers.csv)
             reader = csv.reader(csvfile)
-            header = []
-            units = {}
-
-            # Parse biomarker header
-            for val in next(reader):
-                if "(" not in val:
-                    header.append(val)
-                    continue
-                val = val.strip()
-                name, unit = val.split("(")
-                name = name.strip()
-                units[name] = unit[:-1].strip()
-                header.append(name)
-            for protocol in self.protocols:
-                protocol.setup_data()
-                protocol.biomarker_units = units
-
-            # Parse other lines (lines with numbers)
-            for line in reader:
-                for protocol in self.protocols:
-                    looks = {header[0]: line[0]} #line 0 is str but others need to be a floating point
-                    for name, value in zip(header[1:], line[1:]):
-                        looks[name] = float(value)
-
-                    if not protocol.run(looks):
-                        break
+            header = self.setup(next(reader))
+
+            # Parse other lines (lines with numbers), those are in cell order
+            for idx, line in enumerate(reader, self.experiment.patch.start):
+                calibrated = self.run_row(header, line)
+                if idx in self.experiment.patch:
+                    self.experiment.calibration_done(idx, calibrated)
@@ -1,8 +1,10 @@
 from . import log
 from . import model
 import numpy as np
-import scipy.stats as sstats
+import asyncio
+import functools
 from . import utility
+from . import scheduler
 
 class Experiment:
     def __init__(self, args, patch_idx: int, patch_count: int, seed: int) -> None:
@@ -15,6 +17,11 @@ class Experiment:
         self.parameter_count = args['parameter_count']
         self.manifest_file_name = utility.append_patch(args['manifest'], patch_idx, patch_count)
         self.equation = args['equation'] if 'equation' in args else ""
+        self.jobs = args['jobs'] if 'jobs' in args else 1
+        self.batch = args['batch'] if 'batch' in args else 1
+        self.retention = args['retention'] if 'retention' in args else model.KEEP
+        if self.retention not in model.RETENTIONS:
+            raise ValueError(f'Unknown retention `{self.retention}`, expected one of {model.RETENTIONS}')
         self.seed = seed
         if patch_idx < 0:
             raise ValueError(f"Patch index cannot be less than zero (was `{patch_idx}`)")
@@ -46,6 +53,7 @@ class Experiment:
     def _generate_parameters(self) -> np.ndarray:
         x = np.ndarray([])
         if self.parametrization == 'latin_hybercube':
+            import scipy.stats as sstats # slow to import, dry runs and merges do not need it
             sampler = sstats.qmc.LatinHypercube(d=self.parameter_count, seed=self.seed)
             x = sampler.random(n=self.cells)
         else:
@@ -70,27 +78,62 @@ class Experiment:
 
     def dry(self, models: model.Models) -> None:
         log.print_info(f"Manifest {self.cwd + '/' + self.manifest_file_name}: ")
-        log.print_info(self._internal_run(models, model.Model.dry))
+        log.print_info(self._internal_run(models, model.Model.dry_batch if self.batch > 1 else model.Model.dry, batch=self.batch))
 
-    def run(self, models: model.Models) -> None:
+    def run(self, models: model.Models, done = None) -> None:
+        # done (async function of list of cell indices) is awaited as soon as the model run of those cells has finished
         if not self.patch:
             log.print_info("Patch has no job")
             return
 
-        manifest = self._internal_run(models, model.Model.run)
+        if self.jobs < 1:
+            raise ValueError(f"Jobs must be at least one (was `{self.jobs}`)")
+        if self.batch < 1:
+            raise ValueError(f"Batch must be at least one (was `{self.batch}`)")
+        try:
+            manifest = self._internal_run(models, model.Model.run_batch_async if self.batch > 1 else model.Model.run_async, self.jobs, self.batch, done)
+        finally:
+            models.model(self.model_id).close()
         with open(self.cwd + '/' + self.manifest_file_name, 'w') as f:
             f.write(manifest)
 
-    def _internal_run(self, models: model.Models, method) -> str:
+    def _internal_run(self, models: model.Models, method, jobs: int = 1, batch: int = 1, done = None) -> str:
         self.model: model.Model = models.model(self.model_id)
         # generate all parameters
         parameters = self._generate_parameters()
         manifest = self._generate_manifest(parameters)
 
-        for idx in self.patch:
-            full_path = self.get_directory(idx)
-            method(self.model, full_path, parameters[idx,:])
+        if batch > 1:
+            # Each chunk of cells is given to the method at once, i.e. one model launch per chunk
+            chunks = [range(start, min(start + batch, self.patch.stop)) for start in range(self.patch.start, self.patch.stop, batch)]
+            work = [([self.get_directory(idx) for idx in chunk], parameters[chunk.start:chunk.stop,:]) for chunk in chunks]
+        else:
+            chunks = [[idx] for idx in self.patch]
+            work = [(self.get_directory(idx), parameters[idx,:]) for idx in self.patch]
+        after = None if done == None else [functools.partial(done, list(chunk)) for chunk in chunks]
+
+        if asyncio.iscoroutinefunction(method):
+            # At most `jobs` model runs at once, stuck run only holds its own slot until its timeout
+            scheduler.run_all([method(self.model, full_path, params) for full_path, params in work], jobs, after)
+        else:
+            for full_path, params in work:
+                method(self.model, full_path, params)
         return manifest
 
     def get_data(self, required_names: list, optional_names: list, idx: int) -> dict:
         return self.model.get_data(self.get_directory(idx), required_names, optional_names)
+
+    def biomarkers_done(self, idx: int, required_names: list, optional_names: list) -> None:
+        # Retention of raw outputs that does not depend on calibration
+        if self.retention == model.KEEP:
+            return
+        if self.retention == model.DELETE:
+            self.model.delete_data(self.get_directory(idx))
+        elif self.retention == model.COMPACT:
+            self.model.compact_data(self.get_directory(idx), required_names, optional_names)
+
+    def calibration_done(self, idx: int, calibrated: bool) -> None:
+        if self.retention == model.KEEP:
+            return
+        if (self.retention == model.KEEP_CALIBRATED and not calibrated) or (self.retention == model.KEEP_FAILED and calibrated):
+            self.model.delete_data(self.get_directory(idx))
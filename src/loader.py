@@ -0,0 +1,187 @@
+import numpy as np
+import os
+import struct
+import zipfile
+
+
+def is_fresh(path: str, sources: list) -> bool:
+    # File made from the sources is usable, if it is not older than any of them
+    if not os.path.exists(path):
+        return False
+    mtime = os.path.getmtime(path)
+    return all(os.path.getmtime(source) <= mtime for source in sources)
+
+
+def read_opencarp_header(header_file: str) -> list:
+    with open(header_file, 'r') as f:
+        return ['time'] + [line.replace('\n', '') for line in f.readlines()]
+
+
+def tail_lines(file: str, count: int = None, span: float = None) -> list:
+    '''Last `count` non-empty lines of text file, or the last lines whose first column is within `span` of the last line.
+
+    File is read backwards in growing blocks, so the beginning of a long file is never read.
+    '''
+    with open(file, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        block = 1 << 16
+        data = b''
+        while True:
+            size = min(block, position)
+            position -= size
+            f.seek(position)
+            data = f.read(size) + data
+            lines = data.splitlines()
+            if position > 0:
+                lines = lines[1:] # might be cut in the middle
+            lines = [line for line in lines if line.strip()]
+            if count != None:
+                if position == 0 or len(lines) >= count:
+                    return lines[-count:]
+            elif lines:
+                times = np.array([float(line.split()[0]) for line in lines])
+                start = times[-1] - span
+                if position == 0 or times[0] <= start:
+                    return lines[np.searchsorted(times, start):]
+            elif position == 0:
+                return lines
+            block *= 2
+
+
+def opencarp_trace(trace_file: str, header_file: str, header_names: list, sidecar: bool = False,
+                   tail_samples: int = None, tail_time: float = None) -> dict:
+    '''Read columns `header_names` from the openCARP trace.
+
+    Only requested columns are parsed. With sidecar, each parsed column is stored
+    next to the trace as `<trace>.<column>.npy`, and memory mapped from there on later reads.
+    With `tail_samples` or `tail_time` (in units of the time column) columns without a sidecar
+    are parsed only from the end of the trace, and no sidecar is written.
+    '''
+    header = read_opencarp_header(header_file)
+    columns = {}
+    for header_name in header_names:
+        if header_name not in header:
+            raise ValueError(f'`{header_name}` not found from header `{header_file}`')
+        columns[header_name] = header.index(header_name)
+
+    data = {}
+    to_parse = []
+    for header_name, column in columns.items():
+        sidecar_file = f'{trace_file}.{column}.npy'
+        if sidecar and is_fresh(sidecar_file, [trace_file, header_file]):
+            data[header_name] = np.load(sidecar_file, mmap_mode='r')
+        else:
+            to_parse.append(header_name)
+    if not to_parse:
+        return data
+
+    usecols = sorted(set(columns[header_name] for header_name in to_parse))
+    if tail_samples != None or tail_time != None:
+        lines = tail_lines(trace_file, tail_samples, tail_time)
+        parsed = np.loadtxt(lines, usecols=usecols, ndmin=2)
+        for header_name in to_parse:
+            data[header_name] = parsed[:, usecols.index(columns[header_name])]
+        return data
+    parsed = np.loadtxt(trace_file, usecols=usecols, ndmin=2)
+    for header_name in to_parse:
+        column = columns[header_name]
+        data[header_name] = parsed[:, usecols.index(column)]
+        if sidecar:
+            # written under temporary name, so concurrent readers never see partial sidecar
+            tmp_file = f'{trace_file}.{column}.{os.getpid()}.tmp.npy'
+            np.save(tmp_file, data[header_name])
+            os.replace(tmp_file, f'{trace_file}.{column}.npy')
+    return data
+
+
+BYTEORDERS = {'native': '=', 'little': '<', 'big': '>', '=': '=', '<': '<', '>': '>'}
+
+
+def select(data: np.ndarray, value_data: dict, source: str) -> np.ndarray:
+    # Pick 1-based `col` or `row` from 2d data, or flatten data that is effectively 1d
+    if "col" in value_data and "row" in value_data:
+        raise ValueError(f'Both "row" and "col" defined for val `{value_data["val"]}`.')
+    elif "col" in value_data:
+        col = value_data["col"] - 1
+        if data.ndim != 2 or col < 0 or col >= data.shape[1]:
+            raise ValueError(f'Expected col range [{1}, {data.shape[1] if data.ndim == 2 else 1}], given {value_data["col"]}')
+        return data[:, col]
+    elif "row" in value_data:
+        row = value_data["row"] - 1
+        if data.ndim != 2 or row < 0 or row >= data.shape[0]:
+            raise ValueError(f'Expected row range [{1}, {data.shape[0] if data.ndim == 2 else 1}], given {value_data["row"]}')
+        return data[row, :]
+    shape = data.shape
+    if data.ndim == 2 and shape[0] > 1 and shape[1] > 1:
+        raise ValueError(f"File `{source}` has data that has the shape: {shape}."
+                         f" Specify column 'col' or 'row' in data or "
+                         f"Divide the data into their own arrays")
+    return data.reshape(-1)
+
+
+def binary(file: str, value_data: dict) -> np.ndarray:
+    '''Memory map raw binary file, nothing is read before the data is used.
+
+    Val keys: `dtype` (default float64), `byteorder` (native, little or big), `offset` in bytes
+    to skip e.g. a header, and `shape` (e.g. [-1, 4] for four interleaved signals) with `col` or `row`.
+    '''
+    byteorder = value_data.get('byteorder', 'native')
+    if byteorder not in BYTEORDERS:
+        raise ValueError(f'Unknown byteorder `{byteorder}`, expected one of {list(BYTEORDERS.keys())}')
+    dtype = np.dtype(value_data.get('dtype', 'float64')).newbyteorder(BYTEORDERS[byteorder])
+    data = np.memmap(file, dtype=dtype, mode='r', offset=int(value_data.get('offset', 0)))
+    if 'shape' in value_data:
+        data = data.reshape(value_data['shape'])
+    return select(data, value_data, file)
+
+
+def matlab(file: str, variable_names: list) -> dict:
+    import scipy.io # slow to import, and only needed for matlab files
+    # Only the variables we need are read, the rest of the file is skipped
+    data = scipy.io.loadmat(file, variable_names=variable_names)
+    missing = [name for name in variable_names if name not in data]
+    if missing:
+        raise KeyError(f'Variables {missing} not found from `{file}`')
+    return data
+
+
+def _npz_member(file: str, info: zipfile.ZipInfo) -> np.ndarray:
+    # Memory map uncompressed member of npz archive, compressed ones have to be read
+    with open(file, 'rb') as f:
+        f.seek(info.header_offset)
+        header = f.read(30)
+        if header[:4] != b'PK\x03\x04':
+            raise ValueError(f'Broken archive `{file}`')
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        if dtype.hasobject:
+            raise ValueError(f'Array `{info.filename}` in `{file}` has python objects, which are not supported')
+        return np.memmap(file, dtype=dtype, mode='r', offset=f.tell(), shape=shape, order='F' if fortran_order else 'C')
+
+
+def numpy(file: str, ids: list) -> dict:
+    '''Arrays `ids` from .npz archive, or the array of .npy file stored with every id.
+
+    Arrays are memory mapped when possible, i.e. .npy files and uncompressed (np.savez) archive members.
+    '''
+    if not zipfile.is_zipfile(file):
+        data = np.load(file, mmap_mode='r')
+        return {item_id: data for item_id in ids}
+    arrays = {}
+    with zipfile.ZipFile(file) as archive:
+        members = {info.filename: info for info in archive.infolist()}
+        for item_id in ids:
+            info = members.get(f'{item_id}.npy')
+            if info == None:
+                raise KeyError(f'Array `{item_id}` not found from `{file}`, it has {[name[:-4] for name in members]}')
+            if info.compress_type == zipfile.ZIP_STORED:
+                arrays[item_id] = _npz_member(file, info)
+            else:
+                with archive.open(info) as f:
+                    arrays[item_id] = np.lib.format.read_array(f)
+    return arrays
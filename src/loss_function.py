@@ -18,6 +18,9 @@ class LossFunction:
         self.bio_content = []
         self.dir_name = content["dir_name"]
         self.loss_calculation = None
+        self.retention = content["retention"] if "retention" in content else mod.KEEP
+        if self.retention not in [mod.KEEP, mod.DELETE, mod.COMPACT]:
+            raise ValueError(f"Unknown optimization retention `{self.retention}`, expected one of {[mod.KEEP, mod.DELETE, mod.COMPACT]}")
 
     def setup(self) -> None:
         self.setup_target()
@@ -68,11 +71,12 @@ class LossFunction:
         header = [str(bm) for bm in biomarkers]
 
         # get data through the experiment needed for the biomarkers
-        data = biomarker.Window(self.model.get_data(str(dir_name), names_required, names_optional))
+        beat_count, detection = biomarker.Biomarkers.detection_settings(self.content)
+        data = biomarker.Window(self.model.get_data(str(dir_name), names_required, names_optional), biomarkers, beat_count, detection)
         results = ['nan'] * len(biomarkers)
         for i in range(len(biomarkers)):
             try:
-                value = biomarkers[i].calculate(data)
+                value = data.result(biomarkers[i])
             except:
                 value = float('nan')
             unit = self.target_units[str(biomarkers[i])]
@@ -134,8 +138,12 @@ class LossFunction:
 
         # Save the loss
         self.save_loss(loss, dir_name)
-        # Delete the generated data file
-        # self.model.delete_data(dir_name)
+        # Raw outputs are not needed anymore, the loss is read from loss.txt if the same parameters come again
+        if self.retention == mod.DELETE:
+            self.model.delete_data(dir_name)
+        elif self.retention == mod.COMPACT:
+            biomarkers = [biomarker.BIOMARKERS[name] for name in self.targets.keys()]
+            self.model.compact_data(dir_name, biomarker.Biomarkers.required_data_full(biomarkers), biomarker.Biomarkers.optional_data_full(biomarkers))
 
         log.print_verbose(f"Ending loss calculation for params '{x}' with loss '{loss}'")
         return loss
@@ -1,13 +1,8 @@
 #!/usr/bin/env python3
 
 #import matplotlib.pyplot as plt # temp debug
-from . import merge
-from . import experiment as exp
-from . import model as mod
-from . import biomarker as bm
-from . import calibration as cal
+# Subcommands import what they need, so short runs (e.g. merges) do not pay for scipy and scimath imports
 from . import log
-from . import optimization
 import argparse
 import pathlib
 import shutil
@@ -51,6 +46,7 @@ def run_merge(arg_list):
     with open(args.config, 'r') as f:
         content = yaml.safe_load(f)
 
+    from . import merge
     merger = merge.Merge(content, args.patch_count, args.force, args.dry)
     if not args.skip_experiment:
         merger.merge_experiments()
@@ -72,6 +68,10 @@ def run_job(arg_list):
     parser.add_argument('--verbose', action='store_true',help='Allow extra verbose printing')
     parser.add_argument('--patch_count', help='Define how many patches are going to be used', default=1, metavar="N", type=int)
     parser.add_argument('--patch_idx', help='Define what patch is going to be used for this specific run, range [0,patch_count)', default=0, metavar="IDX", type=int)
+    parser.add_argument('--jobs', help='Define how many cells of the patch are run concurrently, overrides `jobs` in experiment config', default=None, metavar="N", type=int)
+    parser.add_argument('--biomarker-jobs', help='Define how many processes find biomarkers of the patch cells, overrides `jobs` in biomarkers config', default=None, metavar="N", type=int)
+    parser.add_argument('--incremental', action='store_true', help='Reuse biomarkers already in the biomarker files (same name and unit), and only calculate the missing ones. Cells whose model outputs are newer than their biomarkers are calculated again')
+    parser.add_argument('--pipeline', action='store_true', help='Find biomarkers and calibrate each cell as soon as its model run has finished, instead of running the steps one after another. Output files are the same')
     parser.add_argument('--skip-experiment', action='store_true',help='Skip experiment, it is assumed you already have run experiment')
     parser.add_argument('--only-experiment', action='store_true',help='Only run experiment')
     parser.add_argument('--skip-biomarkers', action='store_true',help='Skip biomarkers, following steps might expect biomarkers to exist')
@@ -79,6 +79,7 @@ def run_job(arg_list):
     parser.add_argument('--skip-calibration', action='store_true',help='Skip calibration')
     parser.add_argument('--only-calibration', action='store_true',help='Only run calibration, assumes you have run previous steps already and have the data')
     parser.add_argument('--force', action='store_true', help='Override existing files during the experiment')
+    parser.add_argument('--no-cache', action='store_true', help='Always run the model, even if model has `cache` defined')
     parser.add_argument('--optimization', action='store_true', help='Run only the optimization. Updates given model parameters to achieve target biomarkers')
     parser.add_argument('--seed', help=f'Select seed to be used in random number generation. Positive integer for seed, "random" for random seed. (default={default_seed})', default=default_seed, metavar="SEED", type=str)
 
@@ -107,9 +108,14 @@ def run_job(arg_list):
         args.skip_experiment = True
         args.skip_biomarkers = True
 
+    from . import model as mod
+    from . import experiment as exp
     models = mod.Models(content['model'])
+    if args.no_cache:
+        models.disable_cache()
 
     if args.optimization:
+        from . import optimization
         log.print_info("Start optimization")
         optimization.Optimize(content['optimization'], models, seed)
         log.print_info("End optimization")
@@ -117,9 +123,12 @@ def run_job(arg_list):
 
 
     experiment = exp.Experiment(content['experiment'][0], args.patch_idx, args.patch_count, seed)
+    if args.jobs is not None:
+        experiment.jobs = args.jobs
 
+    pipeline = args.pipeline and not args.dry and not args.skip_experiment and not args.skip_biomarkers
     if not args.skip_experiment:
-        log.print_info('Start experiments')
+        log.print_info('Start experiments' if not pipeline else 'Start pipeline')
         if not args.dry:
             if pathlib.Path(experiment.cwd).exists():
                 if args.force:
@@ -128,23 +137,42 @@ def run_job(arg_list):
                 else:
                     raise FileExistsError(f'Target directory exists `{experiment.cwd}`')
 
+            if pipeline:
+                from . import biomarker as bm
+                from . import pipeline as ppl
+                biomarkers = bm.Biomarkers(content['biomarkers'], args.patch_idx, args.patch_count)
+                if args.biomarker_jobs is not None:
+                    biomarkers.jobs = args.biomarker_jobs
+                calibration = None
+                if not args.skip_calibration:
+                    from . import calibration as cal
+                    calibration = cal.Calibration(content['calibration'], experiment, args.patch_idx, args.patch_count)
+                ppl.Pipeline(experiment, biomarkers, calibration).run(models)
+                log.print_info('End pipeline')
+                return
             experiment.run(models)
         else:
             experiment.dry(models)
         log.print_info('End experiments')
     if not args.skip_biomarkers:
+        from . import biomarker as bm
         log.print_info('Start biomarkers')
         biomarkers = bm.Biomarkers(content['biomarkers'], args.patch_idx, args.patch_count)
+        if args.biomarker_jobs is not None:
+            biomarkers.jobs = args.biomarker_jobs
         if args.skip_experiment:
             experiment.empty_run(models)
         if not args.dry:
-            biomarkers.run(experiment)
+            biomarkers.run(experiment, args.incremental)
         else:
             biomarkers.dry(experiment)
         log.print_info('End biomarkers')
     if not args.skip_calibration:
         log.print_info('Start calibration')
         if not args.dry:
+            from . import calibration as cal
+            if args.skip_experiment and args.skip_biomarkers:
+                experiment.empty_run(models) # retention needs the model
             calibration = cal.Calibration(content['calibration'], experiment, args.patch_idx, args.patch_count)
             calibration.run()
         else:
@@ -56,14 +56,18 @@ class Merge:
         if self.dry:
             log.print_info(f'File({biomarkers_base_file}):\n  ' + '\n  '.join(biomarkers_file))
         else:
+            # Patches might have different columns (e.g. incremental runs), rows are merged by column name
+            # into the union of the columns, missing values are nan
+            patches = [bio.read_results(file_name) for file_name in biomarkers_file]
+            header = []
+            for patch in patches:
+                header += [name for name in patch[0] if name not in header]
             with open(biomarkers_base_file, 'w') as f:
-                header_done = False
-                for file_name in biomarkers_file:
-                    with open(file_name, 'r') as file:
-                        if header_done:
-                            file.readline()
-                        f.write(file.read())
-                        header_done = True
+                f.write(bio.CSV_SEPARATOR.join(header) + bio.CSV_ENDLINE)
+                for patch_header, *lines in patches:
+                    for line in lines:
+                        values = dict(zip(patch_header, line))
+                        f.write(bio.CSV_SEPARATOR.join(values.get(name, 'nan') for name in header) + bio.CSV_ENDLINE)
 
 
 
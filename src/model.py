@@ -1,17 +1,50 @@
 from . import log
 from . import utility
+from . import worker as wrk
+from . import scheduler
+from . import cache as cch
+from . import workspace as wsp
+from . import loader
 import numpy as np
+import asyncio
+import importlib
+import sys
 import os
 import shutil
-import subprocess
-import scipy.io
 import pathlib
 
+COMMAND = 'command'
+WORKER = 'worker'
+PYTHON = 'python'
+MODES = [COMMAND, WORKER, PYTHON]
+TIME = 'time' # val that model tail_time is measured from
+
+# What is left of the raw model outputs of a cell, once its biomarkers (and calibration) are done
+KEEP = 'keep'
+DELETE = 'delete'
+KEEP_CALIBRATED = 'keep_calibrated' # deleted from cells failing the calibration
+KEEP_FAILED = 'keep_failed' # deleted from cells passing the calibration
+COMPACT = 'compact' # signals used by biomarkers are stored in default units to COMPACT_FILE
+RETENTIONS = [KEEP, DELETE, KEEP_CALIBRATED, KEEP_FAILED, COMPACT]
+COMPACT_FILE = 'compact.npz'
+PYTHON_FILE = 'python_outputs.npz' # outputs of python model function, read by vals with method "python"
+TOOL_FILES = ['cmd.txt', 'stdout.txt', 'stderr.txt', scheduler.RETURN_CODE_FILE] # files in cell directory not written by the model
+
 class Model:
     def __init__(self, full_args) -> None:
         self.exec = None
         self.base_directory = None
+        self.workspace = None
+        self.mode = None
+        self.worker_done = None
+        self.timeout = None
+        self.retries = None
+        self.cache = None
+        self.cache_size = None
+        self.tail_samples = None
+        self.tail_time = None
         self.param_key = ''
+        self.batch_key = ''
         self.pars = []
         self.vals = {}
         for args in full_args:
@@ -23,6 +56,10 @@ class Model:
                 if self.param_key != '':
                     raise ValueError('Multiple model param_keys defined.')
                 self.param_key = args['param_key']
+            if 'batch_key' in args:
+                if self.batch_key != '':
+                    raise ValueError('Multiple model batch_keys defined.')
+                self.batch_key = args['batch_key']
             if 'par' in args:
                 self.pars.append(args['par'])
             if 'val' in args:
@@ -31,10 +68,106 @@ class Model:
                 if self.base_directory != None:
                     raise ValueError('Multiple model base directories defined.')
                 self.base_directory = args['base_directory']
+            if 'workspace' in args:
+                if self.workspace != None:
+                    raise ValueError('Multiple model workspaces defined.')
+                self.workspace = args['workspace']
+            if 'mode' in args:
+                if self.mode != None:
+                    raise ValueError('Multiple model modes defined.')
+                self.mode = args['mode']
+            if 'worker_done' in args:
+                if self.worker_done != None:
+                    raise ValueError('Multiple model worker_done defined.')
+                self.worker_done = args['worker_done']
+            if 'timeout' in args:
+                if self.timeout != None:
+                    raise ValueError('Multiple model timeouts defined.')
+                self.timeout = float(args['timeout'])
+            if 'retries' in args:
+                if self.retries != None:
+                    raise ValueError('Multiple model retries defined.')
+                self.retries = int(args['retries'])
+            if 'cache' in args:
+                if self.cache != None:
+                    raise ValueError('Multiple model caches defined.')
+                self.cache = args['cache']
+            if 'cache_size' in args:
+                if self.cache_size != None:
+                    raise ValueError('Multiple model cache sizes defined.')
+                self.cache_size = args['cache_size']
+            if 'tail_samples' in args:
+                if self.tail_samples != None:
+                    raise ValueError('Multiple model tail_samples defined.')
+                self.tail_samples = int(args['tail_samples'])
+            if 'tail_time' in args:
+                if self.tail_time != None:
+                    raise ValueError('Multiple model tail_time defined.')
+                self.tail_time = float(args['tail_time'])
         if self.param_key == '':
             self.param_key = '%#%'
+        if self.batch_key == '':
+            self.batch_key = '%batch%'
         if self.exec == None:
             raise ValueError('exec not defined')
+        if self.exec.startswith(PYTHON + ':'):
+            if self.mode not in [None, PYTHON]:
+                raise ValueError(f'Model exec `{self.exec}` is python function, but mode `{self.mode}` was defined')
+            self.mode = PYTHON
+        if self.mode == None:
+            self.mode = COMMAND
+        if self.mode not in MODES:
+            raise ValueError(f'Unknown model mode `{self.mode}`, expected one of {MODES}')
+        self.function = None # python models: the callable, imported on first run
+        if self.mode == PYTHON:
+            if len(self.exec.split(':')) != 3:
+                raise ValueError(f'Python model exec should be in format "python:package.module:function", was `{self.exec}`')
+            if self.pars:
+                raise ValueError('Python models are called with the parameters, "par" is not used.')
+        for name, value_data in self.vals.items():
+            if value_data['method'] == 'python':
+                if self.mode != PYTHON:
+                    raise ValueError(f'Val `{name}` has method "python", but model exec `{self.exec}` is not a python function')
+                value_data['file'] = PYTHON_FILE
+        if self.worker_done == None:
+            self.worker_done = wrk.DEFAULT_DONE
+        if self.retries == None:
+            self.retries = 0
+        if self.retries < 0:
+            raise ValueError(f'Model retries cannot be negative (was `{self.retries}`)')
+        self.workers = wrk.WorkerPool(self.exec, self.worker_done) if self.mode == WORKER else None
+        if self.workspace == None:
+            self.workspace = wsp.COPY
+        if self.workspace not in wsp.STRATEGIES:
+            raise ValueError(f'Unknown model workspace `{self.workspace}`, expected one of {wsp.STRATEGIES}')
+        if self.cache_size == None:
+            self.cache_size = '10GB'
+        if self.cache != None:
+            if self.mode == PYTHON:
+                raise ValueError('Python models are run in-process, those are not cached.')
+            self.cache = cch.ResultCache(self.cache, self.cache_size)
+        self.base_digest = None
+        if self.tail_samples != None and self.tail_time != None:
+            raise ValueError('Define either model tail_samples or tail_time, not both.')
+        if self.tail_samples != None and self.tail_samples < 1:
+            raise ValueError(f'Model tail_samples must be at least one (was `{self.tail_samples}`)')
+        if self.tail_time != None:
+            if self.tail_time <= 0:
+                raise ValueError(f'Model tail_time must be positive (was `{self.tail_time}`)')
+            if TIME not in self.vals:
+                raise ValueError(f'Model tail_time needs val `{TIME}` to be defined')
+
+    def __getstate__(self) -> dict:
+        # Workers are processes of this process, copies (e.g. optimization workers) start their own
+        state = self.__dict__.copy()
+        state['workers'] = None
+        state['results'] = {}
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        if self.mode == WORKER:
+            self.workers = wrk.WorkerPool(self.exec, self.worker_done)
 
     def __str__(self) -> str:
         return f"{self.exec} {' '.join(self.pars)}"
@@ -58,24 +191,188 @@ class Model:
             full_command.append(new_command_par)
         return full_command
 
+    def _create_batch_command(self, batch_file: str) -> list:
+        if not any(self.batch_key in command_par for command_par in self.pars):
+            raise ValueError(f'Batch key `{self.batch_key}` not found from model pars, model would not know its batch file')
+        return [self.exec] + [command_par.replace(self.batch_key, batch_file) for command_par in self.pars]
+
+    @staticmethod
+    def _batch_directory(directories: list) -> str:
+        first = pathlib.Path(directories[0])
+        return str(first.parent / f'batch_{first.name}')
+
+    def _cache_key(self, parameters) -> str:
+        # Same command with the same base directory gives same results, parameters are included for batches
+        if self.base_digest == None:
+            self.base_digest = cch.directory_digest(self.base_directory) if self.base_directory != None else ''
+        command = ' '.join(self._create_command(parameters))
+        return cch.ResultCache.key('\n'.join([self.mode, command, ', '.join(map(str, parameters)), self.base_digest]))
+
+    def disable_cache(self) -> None:
+        self.cache = None
+
+    def _python_ids(self) -> list:
+        return [value_data['id'] if 'id' in value_data else name for name, value_data in self.vals.items() if value_data['method'] == 'python']
+
+    def _python_call(self, parameters) -> str:
+        return f'{self.exec}({", ".join(map(str, parameters))})'
+
+    def _import_function(self):
+        if self.function == None:
+            _, module_name, function_name = self.exec.split(':')
+            # Modules are searched relative to where we are run, like the other paths in the config
+            if os.getcwd() not in sys.path:
+                sys.path.append(os.getcwd())
+            module = importlib.import_module(module_name)
+            if not hasattr(module, function_name):
+                raise ValueError(f'Function `{function_name}` not found from module `{module_name}`')
+            self.function = getattr(module, function_name)
+        return self.function
+
     def dry(self, cwd, parameters) -> None:
+        if self.mode == PYTHON:
+            log.print_info(f'dry run in {cwd} of\n    {self._python_call(parameters)}')
+            return
         command = self._create_command(parameters)
-        log.print_info(f'dry run in {cwd} of\n    {" ".join(command)}')
+        if self.mode == WORKER:
+            log.print_info(f'dry run in {cwd} with worker `{command[0]}` of\n    {" ".join(command[1:])}')
+        else:
+            log.print_info(f'dry run in {cwd} of\n    {" ".join(command)}')
 
-    def run(self, current_wd, parameters) -> None:
-        command = self._create_command(parameters)
+    def dry_batch(self, directories: list, parameters) -> None:
+        batch_directory = self._batch_directory(directories)
+        command = self._create_batch_command(f'{batch_directory}/batch.csv')
+        log.print_info(f'dry run in {batch_directory} for cells {", ".join(directories)} of\n    {" ".join(command)}')
+
+    def _make_directory(self, current_wd) -> None:
         shutil.rmtree(current_wd, ignore_errors=True)
         if self.base_directory != None:
-            shutil.copytree(self.base_directory, current_wd)
+            wsp.create(self.base_directory, current_wd, self.workspace)
         else:
             os.makedirs(current_wd, exist_ok=True)
-        cmd_file = open(f'{current_wd}/cmd.txt', 'w')
-        stdout_file = open(f'{current_wd}/stdout.txt', 'w')
-        stderr_file = open(f'{current_wd}/stderr.txt', 'w')
-        cmd_file.write(' '.join(command))
-        cmd_file.write('\n')
 
-        subprocess.run(' '.join(command), shell=True, cwd=current_wd, stdout=stdout_file, stderr=stderr_file)
+    def _record_outputs(self, current_wd) -> None:
+        # Only meaningful when there is base directory, otherwise everything is output
+        if self.base_directory != None:
+            wsp.record_outputs(self.base_directory, current_wd, TOOL_FILES)
+
+    @staticmethod
+    def _write_command(current_wd, command: str) -> None:
+        with open(f'{current_wd}/cmd.txt', 'w') as cmd_file:
+            cmd_file.write(command)
+            cmd_file.write('\n')
+
+    async def run_batch_async(self, directories: list, parameters) -> None:
+        # Single launch of the model for all the cells. Model gets file listing the cells,
+        # one per line: `<cell directory>, <parameter 1>, <parameter 2>, ...`, and writes the outputs into those directories
+        if self.mode != COMMAND:
+            raise ValueError(f'Batch is only supported for model mode `{COMMAND}` (was `{self.mode}`)')
+        keys = []
+        if self.cache != None:
+            # Only cells not found from the cache are given to the model
+            misses = []
+            for current_wd, cell_parameters in zip(directories, parameters):
+                key = self._cache_key(cell_parameters)
+                if not await asyncio.to_thread(self.cache.fetch, key, current_wd):
+                    misses.append((current_wd, cell_parameters))
+                    keys.append(key)
+            if not misses:
+                return
+            directories = [current_wd for current_wd, _ in misses]
+            parameters = [cell_parameters for _, cell_parameters in misses]
+        batch_directory = self._batch_directory(directories)
+        batch_file = os.path.abspath(f'{batch_directory}/batch.csv')
+        command = ' '.join(self._create_batch_command(batch_file))
+        shutil.rmtree(batch_directory, ignore_errors=True)
+        os.makedirs(batch_directory)
+        with open(batch_file, 'w') as f:
+            for current_wd, cell_parameters in zip(directories, parameters):
+                f.write(', '.join([os.path.abspath(current_wd)] + [str(par) for par in cell_parameters]) + '\n')
+        for current_wd in directories:
+            await asyncio.to_thread(self._make_directory, current_wd)
+            self._write_command(current_wd, command)
+        self._write_command(batch_directory, command)
+        return_code = await scheduler.run_command(command, batch_directory, self.timeout, self.retries)
+        for current_wd in directories:
+            scheduler.write_return_code(current_wd, return_code)
+            await asyncio.to_thread(self._record_outputs, current_wd)
+        if self.cache != None and return_code == 0:
+            for current_wd, key in zip(directories, keys):
+                await asyncio.to_thread(self.cache.store, key, current_wd)
+
+    def run(self, current_wd, parameters) -> None:
+        scheduler.run(self.run_async(current_wd, parameters))
+
+    async def run_async(self, current_wd, parameters) -> None:
+        if self.mode == PYTHON:
+            await asyncio.to_thread(self._make_directory, current_wd)
+            # Python function cannot be interrupted, so timeout and retries do not apply
+            await asyncio.to_thread(self._run_python, current_wd, parameters)
+            return
+        key = None
+        if self.cache != None:
+            key = self._cache_key(parameters)
+            if await asyncio.to_thread(self.cache.fetch, key, current_wd):
+                return
+        await asyncio.to_thread(self._make_directory, current_wd)
+        command = self._create_command(parameters)
+        if self.mode == WORKER:
+            # Worker is already running `exec`, only parametrized part is sent to it
+            return_code = await asyncio.to_thread(self._run_worker, current_wd, ' '.join(command[1:]))
+        else:
+            self._write_command(current_wd, ' '.join(command))
+            return_code = await scheduler.run_command(' '.join(command), current_wd, self.timeout, self.retries)
+        await asyncio.to_thread(self._record_outputs, current_wd)
+        if key != None and return_code == 0:
+            await asyncio.to_thread(self.cache.store, key, current_wd)
+
+    def _run_worker(self, current_wd, command: str) -> int:
+        self._write_command(current_wd, command)
+        with open(f'{current_wd}/stderr.txt', 'w'):
+            pass # worker stderr is merged into stdout
+        for attempt in range(self.retries + 1):
+            worker = self.workers.acquire()
+            timed_out = False
+            try:
+                with open(f'{current_wd}/stdout.txt', 'w') as stdout_file:
+                    return_code = worker.request(os.path.abspath(current_wd), command, stdout_file, self.timeout)
+            except TimeoutError:
+                # Stuck worker is killed, next request starts a fresh one
+                self.workers.discard(worker, kill=True)
+                timed_out = True
+                return_code = scheduler.KILLED
+            except RuntimeError:
+                self.workers.discard(worker)
+                return_code = worker.process.returncode
+            except:
+                self.workers.discard(worker, kill=True)
+                raise
+            else:
+                self.workers.release(worker)
+            scheduler.write_return_code(current_wd, return_code)
+            if return_code == 0:
+                break
+            scheduler.report_failure(current_wd, return_code, self.timeout if timed_out else None, attempt, self.retries)
+        return return_code
+
+    def _run_python(self, current_wd, parameters) -> None:
+        with open(f'{current_wd}/cmd.txt', 'w') as cmd_file:
+            cmd_file.write(self._python_call(parameters))
+            cmd_file.write('\n')
+        result = self._import_function()(np.asarray(parameters))
+        if not isinstance(result, dict):
+            raise ValueError(f'Python model `{self.exec}` should return dictionary of arrays, returned `{type(result)}`')
+        # Outputs used by vals are stored uncompressed, so biomarkers (also in other processes and later runs) memory map them.
+        # Val the function did not return fails when it is read, like a missing array of numpy file
+        output_file = f'{current_wd}/{PYTHON_FILE}'
+        tmp_file = f'{output_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, **{item_id: np.asarray(result[item_id], dtype=float) for item_id in self._python_ids() if item_id in result})
+        os.replace(tmp_file, output_file)
+
+    def close(self) -> None:
+        if self.workers != None:
+            self.workers.close()
 
     def delete_data(self, current_wd) -> None:
         for name in self.vals.keys():
@@ -83,16 +380,69 @@ class Model:
                 path = current_wd / pathlib.Path(self.vals[name]["file"])
                 if path.exists():
                     os.remove(path)
+                if self.vals[name]['method'] == 'openCARP_trace':
+                    for sidecar in path.parent.glob(f'{path.name}.*.npy'):
+                        os.remove(sidecar)
+
+    def outputs_mtime(self, current_wd):  # -> float OR None
+        # Latest modification of the raw output files of the cell, None if there are none
+        mtimes = [os.path.getmtime(f'{current_wd}/{value_data["file"]}') for value_data in self.vals.values()
+                  if 'file' in value_data and os.path.exists(f'{current_wd}/{value_data["file"]}')]
+        return max(mtimes) if mtimes else None
+
+    def compact_data(self, current_wd, required_names: list, optional_names: list) -> None:
+        # Replace raw outputs with the given signals in default units, get_data reads them from there on
+        data = self.get_data(str(current_wd), required_names, optional_names)
+        compact_file = f'{current_wd}/{COMPACT_FILE}'
+        tmp_file = f'{compact_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.savez_compressed(f, **data)
+        os.replace(tmp_file, compact_file)
+        self.delete_data(current_wd)
+
+    def _read_compact(self, compact_file: str, required_names: list, optional_names: list) -> dict:
+        data = {}
+        with np.load(compact_file) as compact:
+            for name in set(required_names + optional_names):
+                if name in compact.files:
+                    data[name] = compact[name]
+                elif name in required_names:
+                    raise ValueError(f'Required value `{name}` not found from `{compact_file}`, raw outputs were compacted without it')
+        return data
 
     def get_data(self, directory: str, required_names: list, optional_names: list) -> dict:
         ret_data = {}
-        # opencarp = np.genfromtxt(args.name, delimiter=' ')
         traces = {}
-        headers = {}
         mat_files ={}
 
-        names = set(required_names + optional_names)
+        requested = set(required_names + optional_names)
+        compact_file = f'{directory}/{COMPACT_FILE}'
+        if os.path.exists(compact_file) and any('file' in self.vals[name] and not os.path.exists(f'{directory}/{self.vals[name]["file"]}')
+                                                for name in requested if name in self.vals):
+            return self._read_compact(compact_file, required_names, optional_names)
+        names = set(requested)
         required = set(required_names)
+        tail_time = None
+        if self.tail_time != None:
+            # in units of the time val, so the raw time signal can be searched without converting it
+            tail_time = utility.convert_from_default(self.tail_time, self.vals[TIME]['unit'])
+            names.add(TIME)
+        # Each openCARP trace is parsed once, and only for the columns we need
+        trace_columns = {}
+        trace_sidecar = {}
+        for name in names:
+            if name in self.vals and self.vals[name]['method'] == 'openCARP_trace':
+                trace_file = f'{directory}/{self.vals[name]["file"]}'
+                trace_columns.setdefault(trace_file, []).append(self.vals[name]['header_name'])
+                trace_sidecar[trace_file] = trace_sidecar.get(trace_file, False) or self.vals[name].get('sidecar', False)
+        # Likewise only the variables/arrays we need are read from each matlab or numpy file
+        file_ids = {}
+        for name in names:
+            if name in self.vals and self.vals[name]['method'] in ['matlab', 'numpy', 'python']:
+                filename = f'{directory}/{self.vals[name]["file"]}'
+                item_id = self.vals[name]['id'] if 'id' in self.vals[name] else name
+                if item_id not in file_ids.setdefault(filename, []):
+                    file_ids[filename].append(item_id)
 
         for name in names:
             if name not in self.vals:
@@ -101,21 +451,24 @@ class Model:
                 continue
             value_data = self.vals[name]
             if value_data['method'] == 'binary':
-                ret_data[name] = np.fromfile(f'{directory}/{value_data["file"]}')
+                ret_data[name] = loader.binary(f'{directory}/{value_data["file"]}', value_data)
             elif value_data['method'] == 'openCARP_trace':
                 trace_file = f'{directory}/{value_data["file"]}'
                 header_file = f'{directory}/{value_data["header_file"]}'
                 if not trace_file in traces :
-                    traces[trace_file] = np.genfromtxt(trace_file)
-                    lines = open(header_file, 'r').readlines()
-                    headers[header_file] = ['time'] + [line.replace('\n', '') for line in lines]
-                idx = headers[header_file].index(value_data["header_name"])
-                ret_data[name] = traces[trace_file][:, idx]
+                    traces[trace_file] = loader.opencarp_trace(trace_file, header_file, trace_columns[trace_file], trace_sidecar[trace_file],
+                                                               self.tail_samples, tail_time)
+                ret_data[name] = traces[trace_file][value_data["header_name"]]
+            elif value_data['method'] in ['numpy', 'python']:
+                filename = f'{directory}/{value_data["file"]}'
+                if filename not in mat_files:
+                    mat_files[filename] = loader.numpy(filename, file_ids[filename])
+                ret_data[name] = loader.select(mat_files[filename][value_data['id'] if 'id' in value_data else name], value_data, filename)
             elif value_data['method'] == 'matlab':
                 filename = f'{directory}/{value_data["file"]}'
                 item_id = value_data["id"]
                 if filename not in mat_files:
-                    mat_files[filename] = scipy.io.loadmat(f'{directory}/{value_data["file"]}')
+                    mat_files[filename] = loader.matlab(filename, file_ids[filename])
                 if "col" in value_data and "row" in value_data:
                     raise ValueError(f'Both "row" and "col" defined for val `{value_data["val"]}`.')
                 elif "col" in value_data:
@@ -140,13 +493,27 @@ class Model:
 
             else:
                 raise ValueError(f'undefined method to read the data')
+
+        # Only the tail is converted, so memory maps are read just from there
+        tail = self.tail_samples
+        if tail_time != None:
+            time = ret_data[TIME]
+            tail = len(time) - int(np.searchsorted(time, time[-1] - tail_time))
+        for name in list(ret_data.keys()):
+            if name not in requested:
+                del ret_data[name] # time was read only for tail_time
+                continue
+            value_data = self.vals[name]
             if 'unit' in value_data.keys():
                 unit= value_data["unit"]
                 if unit not in utility.unit_to_scimath.keys():
                     raise KeyError(f"Input '{name}' has unit '{unit}' that we do not support. We support the following units: {list(utility.unit_to_scimath.keys())}" )
             else:
                 raise ValueError(f"Unit of `{name}` not defined. We support the following units: {list(utility.unit_to_scimath.keys())}")
-            ret_data[name] = utility.convert_to_default(ret_data[name], value_data["unit"])
+            data = ret_data[name] if tail == None else ret_data[name][-tail:]
+            # Arrays made just for us are converted in place, views and memory maps are left as they are
+            in_place = isinstance(data, np.ndarray) and data.flags.owndata and data.flags.writeable and data.dtype == float
+            ret_data[name] = utility.convert_to_default(data, value_data["unit"], in_place)
         return ret_data
 
 class Models:
@@ -175,3 +542,7 @@ class Models:
 
     def model(self, id: str) -> Model:
         return self.models[id]
+
+    def disable_cache(self) -> None:
+        for model in self.models.values():
+            model.disable_cache()
@@ -178,5 +178,8 @@ class Optimize:
 
         algo = self.setup_algorithm()
 
-        result = algo.run(loss_func=loss_func, seed=self.seed)
+        try:
+            result = algo.run(loss_func=loss_func, seed=self.seed)
+        finally:
+            loss_func.model.close()
         self.save_result(result)
@@ -0,0 +1,74 @@
+from . import biomarker as bm
+from . import experiment as exp
+from . import model as mod
+import asyncio
+import concurrent.futures
+import csv
+import functools
+
+
+class Pipeline:
+    '''Biomarkers and calibration of each cell as soon as its model run has finished, while its outputs are still in the page cache.
+
+    Cells are analysed in `jobs` processes of biomarkers next to the model runs (in a thread of this process,
+    if there is only one job). Results are written in cell order, so the files are the same as when the stages
+    are run one after another.
+    '''
+    def __init__(self, experiment: exp.Experiment, biomarkers: bm.Biomarkers, calibration = None) -> None:
+        self.experiment = experiment
+        self.biomarkers = biomarkers
+        self.calibration = calibration
+        biomarker_file = f'{experiment.cwd}/{biomarkers.patch_file}'
+        if calibration != None and calibration.biomarker_file != biomarker_file:
+            raise ValueError(f'Pipeline calibrates the biomarkers as they are found, calibration file should be `{biomarker_file}` (was `{calibration.biomarker_file}`)')
+        self.file = None
+        self.header = None
+        self.ready = {}
+        self.next = experiment.patch.start
+        self.executor = None
+        self.analyse = None
+
+    def run(self, models: mod.Models) -> None:
+        self.biomarkers.setup()
+        self.experiment.model = models.model(self.experiment.model_id) # biomarker processes get the experiment with its model
+        if self.biomarkers.process_count(self.experiment) > 1:
+            self.executor = concurrent.futures.ProcessPoolExecutor(self.biomarkers.jobs, initializer=bm.start_job, initargs=self.biomarkers.job(self.experiment))
+            self.analyse = bm.job_values
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            self.analyse = functools.partial(bm.cell_values, *self.biomarkers.job(self.experiment))
+        try:
+            self.experiment.run(models, self.cells_done)
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+            if self.file != None:
+                self.file.close()
+
+    def _open(self) -> None:
+        # Files are started only when the first cell is ready, i.e. the experiment directory exists
+        self.file = open(f'{self.experiment.cwd}/{self.biomarkers.patch_file}', 'w')
+        header = self.biomarkers.patch_header()
+        self.file.write(header)
+        if self.calibration != None:
+            self.header = self.calibration.setup(next(csv.reader([header])))
+
+    async def cells_done(self, cells: list) -> None:
+        loop = asyncio.get_running_loop()
+        values = await asyncio.gather(*[loop.run_in_executor(self.executor, self.analyse, idx) for idx in cells])
+        self.ready.update(zip(cells, values))
+        # Only the event loop thread writes, and only the cells whose all predecessors are written
+        while self.next in self.ready:
+            self._write(self.next, self.ready.pop(self.next))
+            self.next += 1
+
+    def _write(self, idx: int, values: list) -> None:
+        if self.file == None:
+            self._open()
+        results = self.biomarkers.format(values)
+        self.biomarkers.write_cell(self.experiment, idx, results)
+        line = self.biomarkers.patch_line(self.experiment, idx, results)
+        self.file.write(line)
+        # Outputs are removed only after their biomarkers are written, as in `Biomarkers.run`
+        self.experiment.biomarkers_done(idx, self.biomarkers.names_required, self.biomarkers.names_optional)
+        if self.calibration != None:
+            self.experiment.calibration_done(idx, self.calibration.run_row(self.header, next(csv.reader([line]))))
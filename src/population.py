@@ -0,0 +1,102 @@
+from . import log
+from multiprocessing import shared_memory
+import concurrent.futures
+import functools
+import numpy as np
+
+
+class Population:
+    '''Signals of every cell of the patch in one (cells x signals x samples) array in shared memory.
+
+    Cells must share the same time grid. Each signal of a cell is contiguous, and processes
+    given the population (e.g. biomarker workers) attach to the same memory instead of reading the cells again.
+    '''
+    def __init__(self, shape: tuple, signals: list, name: str = None, writable: bool = False) -> None:
+        self.shape = tuple(shape)
+        self.signals = list(signals)
+        self.owner = name == None
+        size = max(1, int(np.prod(self.shape)) * np.dtype(float).itemsize)
+        # Attached copies are in processes started by the owner, which share its resource tracker. They must not
+        # unregister the memory, that would drop the registration of the owner too
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.data = np.ndarray(self.shape, dtype=float, buffer=self.memory.buf)
+        self.data.flags.writeable = self.owner or writable
+        self.cells = None # patch index of each row
+        self.directories = None # cell directory of each row
+
+    def __getstate__(self) -> dict:
+        return {'shape': self.shape, 'signals': self.signals, 'name': self.memory.name, 'cells': self.cells, 'directories': self.directories}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state['shape'], state['signals'], state['name'])
+        self.cells = state['cells']
+        self.directories = state['directories']
+
+    @staticmethod
+    def load(experiment, names_required: list, names_optional: list, time: str, jobs: int = 1):  # -> Population OR None
+        # None, if the cells do not have the same signals on the same time grid.
+        # First cell is read here to size the array, the rest are read by `jobs` processes filling their own rows
+        if not experiment.patch:
+            return None
+        first = experiment.get_data(names_required, names_optional, experiment.patch.start)
+        if time not in first:
+            log.print_info(f'Cell `{experiment.get_id(experiment.patch.start)}` has no `{time}`, cells are read one by one')
+            return None
+        population = Population((len(experiment.patch), len(first), len(first[time])), first.keys())
+        population.cells = experiment.patch
+        population.directories = [experiment.get_directory(cell) for cell in experiment.patch]
+        try:
+            same_grid = [population.fill(0, first, time)]
+            rows = range(1, len(experiment.patch))
+            if same_grid[0] and jobs > 1 and rows:
+                fill = functools.partial(fill_cell, population.memory.name, population.shape, population.signals,
+                                         experiment, names_required, names_optional, time)
+                with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+                    same_grid += executor.map(fill, rows, experiment.patch[1:], chunksize=max(1, len(rows) // (4 * jobs)))
+            elif same_grid[0]:
+                for row, idx in zip(rows, experiment.patch[1:]):
+                    same_grid.append(population.fill(row, experiment.get_data(names_required, names_optional, idx), time))
+                    if not same_grid[-1]:
+                        break
+        except:
+            population.close()
+            raise
+        if not all(same_grid):
+            idx = experiment.patch[same_grid.index(False)]
+            log.print_info(f'Cell `{experiment.get_id(idx)}` does not share signals and time grid with the others, cells are read one by one')
+            population.close()
+            return None
+        return population
+
+    def fill(self, row: int, data: dict, time: str) -> bool:
+        # Row is left unfilled, if the cell does not share signals and time grid with the first row.
+        # Order of the signals does not matter, in other processes get_data might give them in other order
+        same_grid = set(data) == set(self.signals) \
+            and all(len(data[signal]) == self.shape[2] for signal in self.signals) \
+            and (row == 0 or np.array_equal(data[time], self.data[0, self.signals.index(time)]))
+        if same_grid:
+            for signal_idx, signal in enumerate(self.signals):
+                self.data[row, signal_idx] = data[signal]
+        return same_grid
+
+    def get_data(self, required_names: list, optional_names: list, idx: int) -> dict:
+        row = idx - self.cells.start
+        return {signal: self.data[row, signal_idx] for signal_idx, signal in enumerate(self.signals)
+                if signal in required_names or signal in optional_names}
+
+    def get_directory(self, idx: int) -> str:
+        return self.directories[idx - self.cells.start]
+
+    def close(self) -> None:
+        self.data = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+def fill_cell(name: str, shape: tuple, signals: list, experiment, names_required: list, names_optional: list, time: str, row: int, idx: int) -> bool:
+    population = Population(shape, signals, name, writable=True)
+    try:
+        return population.fill(row, experiment.get_data(names_required, names_optional, idx), time)
+    finally:
+        population.close()
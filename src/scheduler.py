@@ -0,0 +1,78 @@
+from . import log
+import asyncio
+import concurrent.futures
+import os
+import signal
+
+RETURN_CODE_FILE = 'returncode.txt'
+KILLED = -signal.SIGKILL # return code of the runs killed because of timeout
+
+
+def kill_group(pid: int) -> None:
+    # Processes are started into their own session, so the shell and everything it started are killed
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def write_return_code(directory: str, return_code: int) -> None:
+    with open(f'{directory}/{RETURN_CODE_FILE}', 'w') as f:
+        f.write(f'{return_code}\n')
+
+
+async def run_command(command: str, cwd: str, timeout: float = None, retries: int = 0) -> int:
+    '''Run shell command in cwd, writing stdout.txt, stderr.txt and returncode.txt there.
+
+    Command is killed with its process group after `timeout` seconds, and run
+    again at most `retries` times, if it times out or returns non-zero.
+    '''
+    for attempt in range(retries + 1):
+        timed_out = False
+        with open(f'{cwd}/stdout.txt', 'w') as stdout_file, open(f'{cwd}/stderr.txt', 'w') as stderr_file:
+            process = await asyncio.create_subprocess_shell(command, cwd=cwd, stdout=stdout_file, stderr=stderr_file,
+                                                            start_new_session=True)
+            try:
+                return_code = await asyncio.wait_for(process.wait(), timeout)
+            except asyncio.TimeoutError:
+                timed_out = True
+                kill_group(process.pid)
+                return_code = await process.wait()
+            except asyncio.CancelledError:
+                kill_group(process.pid)
+                raise
+        write_return_code(cwd, return_code)
+        if return_code == 0:
+            break
+        report_failure(cwd, return_code, timeout if timed_out else None, attempt, retries)
+    return return_code
+
+
+def report_failure(cwd: str, return_code: int, timeout, attempt: int, retries: int) -> None:
+    reason = f'timed out after {timeout} s' if timeout != None else f'returned {return_code}'
+    if attempt < retries:
+        log.print_verbose(f'Run in `{cwd}` {reason}, retrying ({attempt + 1}/{retries})')
+    else:
+        log.print_info(f'Run in `{cwd}` {reason}')
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def run_all(coroutines: list, jobs: int, after: list = None) -> list:
+    # At most `jobs` coroutines are running at once, results are in the same order as given.
+    # after[i] (async function) is awaited when coroutine i has finished, it does not take a place from the others
+    async def run_bounded():
+        semaphore = asyncio.Semaphore(jobs)
+        # blocking parts (e.g. worker requests) are run in threads, so those need as many threads
+        asyncio.get_running_loop().set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=jobs))
+
+        async def bounded(coroutine, then):
+            async with semaphore:
+                result = await coroutine
+            if then != None:
+                await then()
+            return result
+        return await asyncio.gather(*[bounded(coroutine, None if after == None else after[i]) for i, coroutine in enumerate(coroutines)])
+    return asyncio.run(run_bounded())
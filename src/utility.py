@@ -1,5 +1,4 @@
-import scimath.units.api as API
-import scimath.units.SI as SI
+import numpy as np
 
 def append_patch(name, id, count) -> str:
     return f'{name}-{id + 1}-{count}' if count > 1 else name
@@ -16,29 +15,31 @@ UNITLESS = "unitless"
 VOLT_PER_SECOND = "volt_per_second"
 DEFAULT = "default"
 
-base_units = {
-        TIME: {DEFAULT: SI.second, "s": SI.second, "ms": SI.milli * SI.second, "min": 60 * SI.second},
-        POTENTIAL: {DEFAULT: SI.volt, "V": SI.volt, "mV": SI.volt*SI.milli, "uV": SI.micro*SI.volt},
-        CURRENT: {DEFAULT: SI.ampere, "A": SI.ampere, "mA": SI.milli*SI.ampere, "uA": SI.micro*SI.ampere},
-        FORCE: {DEFAULT: SI.newton,"N": SI.newton, "mN": SI.milli*SI.newton},
-        LENGTH: {DEFAULT: SI.meter,'m': SI.meter, "mm": SI.milli*SI.meter},
-        MOLAR: {DEFAULT: SI.mole,"mol": SI.mole, "umol" : SI.mole*SI.micro, "mmol" : SI.mole*SI.milli},
-        UNITLESS : {DEFAULT: SI.none, "unitless": SI.none},
-        }
-derived_units = {
-        FORCE_PER_AREA: {DEFAULT: base_units[FORCE][DEFAULT]/base_units[LENGTH][DEFAULT]**2,
-                         "mN/mm2":(SI.milli*SI.newton)/((SI.milli*SI.meter)**2)},
-        VOLT_PER_SECOND: {DEFAULT: base_units[POTENTIAL][DEFAULT]/base_units[TIME][DEFAULT],
-                          "mV/ms": (SI.milli*SI.volt)/(SI.milli*SI.second),
-                          "V/s": SI.volt / SI.second},
-        FREQUENCY: {DEFAULT: 1/base_units[TIME][DEFAULT],
-                    "Hz": 1/base_units[TIME]["s"],
-                    "bpm": 1/base_units[TIME]["min"]},
-        }
+def initialize_units() -> dict:
+    import scimath.units.SI as SI
+    base_units = {
+            TIME: {DEFAULT: SI.second, "s": SI.second, "ms": SI.milli * SI.second, "min": 60 * SI.second},
+            POTENTIAL: {DEFAULT: SI.volt, "V": SI.volt, "mV": SI.volt*SI.milli, "uV": SI.micro*SI.volt},
+            CURRENT: {DEFAULT: SI.ampere, "A": SI.ampere, "mA": SI.milli*SI.ampere, "uA": SI.micro*SI.ampere},
+            FORCE: {DEFAULT: SI.newton,"N": SI.newton, "mN": SI.milli*SI.newton},
+            LENGTH: {DEFAULT: SI.meter,'m': SI.meter, "mm": SI.milli*SI.meter},
+            MOLAR: {DEFAULT: SI.mole,"mol": SI.mole, "umol" : SI.mole*SI.micro, "mmol" : SI.mole*SI.milli},
+            UNITLESS : {DEFAULT: SI.none, "unitless": SI.none},
+            }
+    derived_units = {
+            FORCE_PER_AREA: {DEFAULT: base_units[FORCE][DEFAULT]/base_units[LENGTH][DEFAULT]**2,
+                             "mN/mm2":(SI.milli*SI.newton)/((SI.milli*SI.meter)**2)},
+            VOLT_PER_SECOND: {DEFAULT: base_units[POTENTIAL][DEFAULT]/base_units[TIME][DEFAULT],
+                              "mV/ms": (SI.milli*SI.volt)/(SI.milli*SI.second),
+                              "V/s": SI.volt / SI.second},
+            FREQUENCY: {DEFAULT: 1/base_units[TIME][DEFAULT],
+                        "Hz": 1/base_units[TIME]["s"],
+                        "bpm": 1/base_units[TIME]["min"]},
+            }
+    return base_units | derived_units
 
-units = base_units | derived_units
 
-def initialize_default_unit_of():
+def initialize_default_unit_of(units: dict):
 
     default_unit_of = {}
     unit_to_scimath = {}
@@ -57,16 +58,65 @@ def initialize_default_unit_of():
     return default_unit_of, unit_to_scimath, default_option
 
 
-default_unit_of, unit_to_scimath, default_option = initialize_default_unit_of()
+def _conversion(from_unit, to_unit):
+    # Same arithmetic as scimath.units.api.convert: value * factor + offset, None when units are equal
+    if from_unit == to_unit:
+        return None
+    factor = float(from_unit / to_unit)
+    offset = getattr(from_unit, 'offset', 0.0) * factor - getattr(to_unit, 'offset', 0.0)
+    return factor, offset
+
+
+_tables = None
+
+
+def unit_tables() -> dict:
+    # scimath is slow to import, so the units are made when they are needed for the first time,
+    # after that scimath is not used and conversions are plain multiplications
+    global _tables
+    if _tables == None:
+        units = initialize_units()
+        default_unit_of, unit_to_scimath, default_option = initialize_default_unit_of(units)
+        _tables = {
+            'units': units,
+            'default_unit_of': default_unit_of,
+            'unit_to_scimath': unit_to_scimath,
+            'default_option': default_option,
+            'to_default_conversion': {unit: _conversion(unit_to_scimath[unit], default_unit_of[unit]) for unit in unit_to_scimath},
+            'from_default_conversion': {unit: _conversion(default_unit_of[unit], unit_to_scimath[unit]) for unit in unit_to_scimath},
+        }
+    return _tables
+
+
+def __getattr__(name: str):
+    # e.g. utility.unit_to_scimath
+    if name.startswith('__'):
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+    tables = unit_tables()
+    if name in tables:
+        return tables[name]
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+def _convert(data, conversion, in_place: bool):
+    if conversion == None:
+        return data
+    factor, offset = conversion
+    if not isinstance(data, np.ndarray):
+        return data * factor + offset
+    if in_place:
+        out = np.multiply(data, factor, out=data)
+    else:
+        out = np.multiply(data, factor)
+    out += offset
+    return out
+
 
+def convert_to_default(data, unit, in_place: bool = False): # -> np.ndarray OR float
+    # in_place overwrites data, which then has to be writeable float array
+    return _convert(data, unit_tables()['to_default_conversion'][unit], in_place)
 
-def convert_to_default(data, unit): # -> np.ndarray OR float
-    from_unit = unit_to_scimath[unit]
-    to_unit = default_unit_of[unit]
-    return API.convert(data, from_unit, to_unit)
 
+def convert_from_default(data, unit, in_place: bool = False): # -> np.ndarray OR float
+    return _convert(data, unit_tables()['from_default_conversion'][unit], in_place)
 
-def convert_from_default(data, unit): # -> np.ndarray OR float
-    from_unit = default_unit_of[unit]
-    to_unit = unit_to_scimath[unit]
-    return API.convert(data, from_unit, to_unit)
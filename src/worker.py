@@ -0,0 +1,109 @@
+from . import scheduler
+import json
+import queue
+import subprocess
+import threading
+import time
+
+DEFAULT_DONE = 'POMTOOL_DONE'
+
+
+class Worker:
+    '''Long-lived model process serving one cell at a time.
+
+    Each request is written to the worker stdin as a single json line
+    `{"cwd": <cell directory>, "command": <parametrized command>}`. Worker
+    answers by printing a line starting with the done token, optionally
+    followed by return code (e.g. `POMTOOL_DONE 0`). All lines printed
+    before that belong to the request and are stored to the cell stdout.
+    '''
+    def __init__(self, command: str, done: str = DEFAULT_DONE) -> None:
+        self.command = command
+        self.done = done
+        # stderr is merged, so whatever worker prints ends up to the cell that it was serving
+        self.process = subprocess.Popen(command, shell=True, text=True, bufsize=1, start_new_session=True,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.lines = queue.Queue()
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def _read(self) -> None:
+        for line in self.process.stdout:
+            self.lines.put(line)
+        self.lines.put(None) # end of stream
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def request(self, cwd: str, command: str, stdout_file, timeout: float = None) -> int:
+        # Raises TimeoutError if there is no answer in `timeout` seconds, and RuntimeError if worker has exited
+        if not self.is_alive():
+            raise RuntimeError(f'Worker `{self.command}` has exited with code {self.process.returncode}')
+        try:
+            self.process.stdin.write(json.dumps({'cwd': cwd, 'command': command}) + '\n')
+            self.process.stdin.flush()
+        except OSError:
+            raise RuntimeError(f'Worker `{self.command}` has exited with code {self.process.wait()}')
+        deadline = None if timeout == None else time.monotonic() + timeout
+        while True:
+            try:
+                line = self.lines.get(timeout=None if deadline == None else max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise TimeoutError(f'Worker `{self.command}` did not answer to `{command}` in {timeout} s')
+            if line is None:
+                raise RuntimeError(f'Worker `{self.command}` exited before answering to `{command}`')
+            if line.startswith(self.done):
+                return_code = line[len(self.done):].strip()
+                return int(return_code) if return_code else 0
+            stdout_file.write(line)
+
+    def close(self, kill: bool = False) -> None:
+        if self.is_alive() and not kill:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                kill = True
+        if kill:
+            scheduler.kill_group(self.process.pid)
+            self.process.wait()
+        self.reader.join()
+
+
+class WorkerPool:
+    '''Starts workers lazily, so there is at most one worker per concurrently running cell'''
+    def __init__(self, command: str, done: str = DEFAULT_DONE) -> None:
+        self.command = command
+        self.done = done
+        self.idle = queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def acquire(self) -> Worker:
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            worker = Worker(self.command, self.done)
+            with self.lock:
+                self.workers.append(worker)
+            return worker
+
+    def release(self, worker: Worker) -> None:
+        if worker.is_alive():
+            self.idle.put(worker)
+        else:
+            self.discard(worker)
+
+    def discard(self, worker: Worker, kill: bool = False) -> None:
+        worker.close(kill)
+        with self.lock:
+            if worker in self.workers:
+                self.workers.remove(worker)
+
+    def close(self) -> None:
+        with self.lock:
+            workers = self.workers
+            self.workers = []
+        for worker in workers:
+            worker.close()
+        self.idle = queue.Queue()
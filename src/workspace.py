@@ -0,0 +1,110 @@
+from . import log
+import os
+import shutil
+
+COPY = 'copy'
+HARDLINK = 'hardlink'
+SYMLINK_TREE = 'symlink-tree'
+OVERLAY = 'overlay'
+STRATEGIES = [COPY, HARDLINK, SYMLINK_TREE, OVERLAY]
+
+OUTPUTS_FILE = 'workspace_outputs.txt'
+
+
+def link_or_copy(src, dst) -> None:
+    # Hardlink when possible, directories might be on different file systems
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def unshare(path) -> None:
+    # File hardlinked elsewhere (e.g. to result cache entry) is removed before it is rewritten, so the other links keep their data
+    if os.path.isfile(path) and not os.path.islink(path) and os.stat(path).st_nlink > 1:
+        os.remove(path)
+
+
+def symlink(src, dst) -> None:
+    os.symlink(os.path.abspath(src), dst)
+
+
+def create(base_directory: str, current_wd: str, strategy: str) -> None:
+    '''Make cell directory from the model base directory.
+
+    copy: full copy, model can do anything with the files.
+    hardlink: files share the data with the base, model must not modify base files in place (replacing is fine).
+    symlink-tree: directories are made, files are symlinks to the base. New files can be written anywhere,
+      but rewriting a linked file in place writes into the base.
+    overlay: base directory entries are symlinked to the cell directory as they are. Cheapest, but anything written
+      into a linked directory or linked file goes into the base.
+    Base is shared by every cell, writes through the links are reported by `record_outputs`.
+    '''
+    if strategy == COPY:
+        shutil.copytree(base_directory, current_wd)
+    elif strategy == HARDLINK:
+        shutil.copytree(base_directory, current_wd, copy_function=link_or_copy)
+    elif strategy == SYMLINK_TREE:
+        shutil.copytree(base_directory, current_wd, copy_function=symlink)
+    elif strategy == OVERLAY:
+        os.makedirs(current_wd)
+        for entry in os.scandir(base_directory):
+            symlink(entry.path, os.path.join(current_wd, entry.name))
+    else:
+        raise ValueError(f'Unknown workspace `{strategy}`, expected one of {STRATEGIES}')
+
+
+def _written_through(path: str, link: str) -> bool:
+    # Symlinks point into the base, target modified after the link was made has been written by the model
+    return os.path.exists(path) and os.stat(path).st_mtime_ns > os.lstat(link).st_mtime_ns
+
+
+def _is_from_base(path: str, base_path: str) -> bool:
+    if not os.path.isfile(base_path):
+        return False
+    if os.path.samefile(path, base_path):
+        return True # hardlink
+    # copies keep their size and modification time, unless model has written them
+    path_stat = os.stat(path)
+    base_stat = os.stat(base_path)
+    return path_stat.st_size == base_stat.st_size and path_stat.st_mtime == base_stat.st_mtime
+
+
+def _walk(base_directory: str, current_wd: str, ignore: list) -> tuple[list, list]:
+    # Files the model has written into the cell directory, and those of them written through links into the base
+    written = []
+    into_base = []
+    links = {} # directories reached through a symlink to the base, and that symlink
+    for root, dirs, files in os.walk(current_wd, followlinks=True):
+        dirs.sort()
+        for name in dirs:
+            path = os.path.join(root, name)
+            links[path] = path if os.path.islink(path) else links.get(root)
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, current_wd)
+            if relative in ignore:
+                continue
+            link = path if os.path.islink(path) else links.get(root)
+            if link != None:
+                if _written_through(path, link):
+                    written.append(relative)
+                    into_base.append(relative)
+            elif not _is_from_base(path, os.path.join(base_directory, relative)):
+                written.append(relative)
+    return written, into_base
+
+
+def outputs(base_directory: str, current_wd: str, ignore: list = []) -> list:
+    # Files the model has written into the cell directory, i.e. those not coming from the base
+    return _walk(base_directory, current_wd, ignore)[0]
+
+
+def record_outputs(base_directory: str, current_wd: str, ignore: list = []) -> None:
+    written, into_base = _walk(base_directory, current_wd, ignore + [OUTPUTS_FILE])
+    if len(into_base) > 0:
+        log.print_info(f'Warning: model wrote through the workspace links of {current_wd} into base directory {base_directory}, '
+                       f'which is shared by every cell: {", ".join(into_base)}')
+    with open(os.path.join(current_wd, OUTPUTS_FILE), 'w') as f:
+        for relative in written:
+            f.write(relative + '\n')
@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+# Stand-in for a model run as a command, `stand_in_model.py <parameter>` writes `res.npz` to the working directory.
+# Cycle length grows with the parameter, and cells with parameter below 0.2 have no beats.
+import sys
+import pathlib
+import time
+
+sys.path.append(str(pathlib.Path(__file__).parent))
+from test_window import make_data
+import numpy as np
+
+parameter = float(sys.argv[1])
+# later cells finish first when run concurrently
+time.sleep(0.3 * (1 - parameter))
+data = make_data(cl=0.6 + 0.2 * parameter)
+if parameter < 0.2:
+    data['Vm'] = np.zeros_like(data['Vm'])
+np.savez('res.npz', **data)
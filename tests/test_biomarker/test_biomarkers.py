@@ -0,0 +1,218 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parents[2]))
+sys.path.append(str(pathlib.Path(__file__).parent))
+import src.biomarker as biomarker
+import src.calibration as cal
+import src.main as main
+import src.merge as merge
+import src.experiment as exp
+import src.model as mod
+import src.population as pop
+from test_window import make_data
+import os
+from multiprocessing import shared_memory
+import numpy as np
+import pickle
+import pytest
+import yaml
+
+STAND_IN_MODEL = pathlib.Path(__file__).parent / 'stand_in_model.py'
+
+
+def make_experiment(cwd: pathlib.Path, cells: int, same_grid: bool = False, longer_cell: int = None) -> exp.Experiment:
+    experiment = exp.Experiment({'name': 'cell_#', 'id': 'exp', 'model': 'npy_model', 'cwd': str(cwd), 'parametrization': 'latin_hybercube',
+                                 'cells': cells, 'parameter_count': 1, 'manifest': 'manifest.txt'}, 0, 1, 0)
+    experiment.model = mod.Model([{'id': 'npy_model', 'exec': 'true'},
+                                  {'val': 'time', 'unit': 's', 'method': 'numpy', 'file': 'res.npz'},
+                                  {'val': 'Vm', 'unit': 'V', 'method': 'numpy', 'file': 'res.npz'},
+                                  {'val': 'Cai', 'unit': 'mmol', 'method': 'numpy', 'file': 'res.npz'}])
+    for idx in experiment.patch:
+        directory = pathlib.Path(experiment.get_directory(idx))
+        directory.mkdir(parents=True)
+        if same_grid:
+            # population needs the cells on the same time grid
+            data = make_data(beats=13 if idx == longer_cell else 12)
+            data['Vm'] *= 1 + 0.05 * idx
+        else:
+            data = make_data(cl=0.6 + 0.05 * idx)
+        if idx == 2:
+            data['Vm'] = np.zeros_like(data['Vm']) # no beats, biomarkers are nan
+        np.savez(directory / 'res.npz', **data)
+    return experiment
+
+
+def biomarker_config(jobs: int, shared_population: bool = False) -> list:
+    return [{'target': 'exp', 'file': 'biomarkers.csv', 'jobs': jobs, 'shared_population': shared_population},
+            {'biomarker': 'MDP', 'unit': 'mV'}, {'biomarker': 'CL'}, {'biomarker': 'APD90'}, {'biomarker': 'Max_Cai'}]
+
+
+@pytest.mark.parametrize('shared_population', [False, True])
+def test_jobs_give_same_files(tmp_path, shared_population):
+    experiment = make_experiment(tmp_path, 5, same_grid=shared_population)
+    biomarker.Biomarkers(biomarker_config(1), 0, 1).run(experiment)
+    serial = {path: path.read_text() for path in tmp_path.rglob('biomarkers.csv')}
+    for path in serial:
+        path.unlink()
+    biomarker.Biomarkers(biomarker_config(3, shared_population), 0, 1).run(experiment)
+    assert {path: path.read_text() for path in tmp_path.rglob('biomarkers.csv')} == serial
+
+    lines = serial[tmp_path / 'biomarkers.csv'].splitlines()
+    assert lines[0] == 'directory, MDP (mV), CL (s), APD90 (s), Max_Cai (mol)'
+    assert [line.split(', ')[0] for line in lines[1:]] == [f'cell_{idx}' for idx in range(1, 6)]
+    assert 'nan' in lines[3] and 'nan' not in lines[1]
+
+
+def test_jobs_must_be_positive(tmp_path):
+    experiment = make_experiment(tmp_path, 1)
+    with pytest.raises(ValueError):
+        biomarker.Biomarkers(biomarker_config(0), 0, 1).run(experiment)
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_population_shares_cells(tmp_path, jobs):
+    experiment = make_experiment(tmp_path, 4, same_grid=True)
+    population = pop.Population.load(experiment, ['time', 'Vm'], ['Cai'], 'time', jobs)
+    try:
+        attached = pickle.loads(pickle.dumps(population))
+        for idx in experiment.patch:
+            data = attached.get_data(['time', 'Vm'], [], idx)
+            expected = experiment.get_data(['time', 'Vm'], [], idx)
+            assert sorted(data) == ['Vm', 'time']
+            assert all(np.array_equal(data[name], expected[name]) for name in expected)
+        assert not attached.data.flags.writeable
+        attached.close()
+    finally:
+        population.close()
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_population_needs_same_time_grid(tmp_path, jobs):
+    experiment = make_experiment(tmp_path, 5, same_grid=True, longer_cell=3)
+    assert pop.Population.load(experiment, ['time', 'Vm'], [], 'time', jobs) == None
+    assert pop.Population.load(make_experiment(tmp_path / 'cl', 5), ['time', 'Vm'], [], 'time', jobs) == None
+
+
+def test_population_signal_order(tmp_path):
+    experiment = make_experiment(tmp_path, 2, same_grid=True)
+    population = pop.Population.load(experiment, ['time', 'Vm'], ['Cai'], 'time')
+    try:
+        # e.g. process with other hash seed reads the signals in other order
+        data = experiment.get_data(['time', 'Vm'], ['Cai'], 1)
+        assert population.fill(1, dict(reversed(data.items())), 'time')
+        assert all(np.array_equal(population.get_data(['time', 'Vm', 'Cai'], [], 1)[name], data[name]) for name in data)
+    finally:
+        population.close()
+
+
+def test_population_is_released_on_error(tmp_path, monkeypatch):
+    experiment = make_experiment(tmp_path, 4, same_grid=True)
+    get_data = experiment.get_data
+    def failing_get_data(required_names, optional_names, idx):
+        if idx == 2:
+            raise ValueError('unreadable cell')
+        return get_data(required_names, optional_names, idx)
+    monkeypatch.setattr(experiment, 'get_data', failing_get_data)
+    created = []
+    init = pop.Population.__init__
+    def recording_init(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        created.append(self.memory.name)
+    monkeypatch.setattr(pop.Population, '__init__', recording_init)
+
+    with pytest.raises(ValueError):
+        pop.Population.load(experiment, ['time', 'Vm'], [], 'time')
+    assert len(created) == 1
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=created[0])
+
+
+def write_config(cwd: pathlib.Path, jobs: int, retention: str = 'keep') -> pathlib.Path:
+    model = [{'id': 'stand_in', 'exec': f'{sys.executable} {STAND_IN_MODEL}'}, {'par': '%1%'},
+             {'val': 'time', 'unit': 's', 'method': 'numpy', 'file': 'res.npz'},
+             {'val': 'Vm', 'unit': 'V', 'method': 'numpy', 'file': 'res.npz'},
+             {'val': 'Cai', 'unit': 'mmol', 'method': 'numpy', 'file': 'res.npz'}]
+    experiment = [{'name': 'cell_#', 'id': 'exp', 'model': 'stand_in', 'cwd': str(cwd), 'parametrization': 'latin_hybercube',
+                   'cells': 5, 'parameter_count': 1, 'manifest': 'manifest.txt', 'jobs': 3, 'retention': retention}]
+    calibration = [{'file': 'biomarkers.csv'}, {'protocol': 'nonan', 'fail_path': 'fail.csv', 'success_path': 'success.csv'}]
+    config = cwd.parent / f'{cwd.name}.yaml'
+    config.write_text(yaml.safe_dump({'model': model, 'experiment': experiment, 'biomarkers': biomarker_config(jobs), 'calibration': calibration}))
+    return config
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_pipeline_gives_same_files(tmp_path, capsys, jobs):
+    main.run_job(['--config', str(write_config(tmp_path / 'staged', 1)), '--force'])
+    capsys.readouterr()
+    main.run_job(['--config', str(write_config(tmp_path / 'pipeline', jobs)), '--force', '--pipeline'])
+    # pipeline does all the steps, they are not run again
+    out = capsys.readouterr().out
+    assert 'End pipeline' in out and 'Start biomarkers' not in out and 'Start calibration' not in out
+
+    staged = {str(path.relative_to(tmp_path / 'staged')): path.read_text() for path in (tmp_path / 'staged').rglob('*.csv')}
+    assert staged == {str(path.relative_to(tmp_path / 'pipeline')): path.read_text() for path in (tmp_path / 'pipeline').rglob('*.csv')}
+    # cells finish in reverse order of their parameter, and the cell with the smallest one has no beats
+    assert len(staged['fail.csv'].splitlines()) == 1
+    assert len(staged['success.csv'].splitlines()) == 4
+    assert [line.split(', ')[0] for line in staged['biomarkers.csv'].splitlines()[1:]] == [f'cell_{idx}' for idx in range(1, 6)]
+
+
+@pytest.mark.parametrize('retention', ['delete', 'keep_failed'])
+def test_pipeline_retention(tmp_path, retention):
+    main.run_job(['--config', str(write_config(tmp_path / 'staged', 1, retention)), '--force', '--silent'])
+    main.run_job(['--config', str(write_config(tmp_path / 'pipeline', 2, retention)), '--force', '--silent', '--pipeline'])
+
+    for cwd in ['staged', 'pipeline']:
+        failed = (tmp_path / cwd / 'fail.csv').read_text().split(',')[0].strip()
+        assert [path.parent.name for path in (tmp_path / cwd).glob('cell_*/res.npz')] == ([failed] if retention == 'keep_failed' else [])
+        assert len(list((tmp_path / cwd).glob('cell_*/biomarkers.csv'))) == 5
+    assert (tmp_path / 'staged' / 'biomarkers.csv').read_text() == (tmp_path / 'pipeline' / 'biomarkers.csv').read_text()
+
+
+def test_incremental_reuses_results(tmp_path):
+    experiment = make_experiment(tmp_path, 3)
+    biomarker.Biomarkers([{'target': 'exp', 'file': 'biomarkers.csv'}, {'biomarker': 'MDP', 'unit': 'mV'}, {'biomarker': 'APA', 'unit': 'mV'},
+                          {'biomarker': 'Max_Cai', 'unit': 'mmol'}], 0, 1).run(experiment)
+    for idx in experiment.patch:
+        cell_file = pathlib.Path(experiment.get_directory(idx)) / 'biomarkers.csv'
+        header, line = cell_file.read_text().splitlines()
+        cell_file.write_text(f'{header}\n-123.0, {", ".join(line.split(", ")[1:])}\n')
+    # outputs of the last cell are newer than its biomarkers
+    outputs = pathlib.Path(experiment.get_directory(2)) / 'res.npz'
+    os.utime(outputs, (outputs.stat().st_mtime + 10, outputs.stat().st_mtime + 10))
+
+    biomarker.Biomarkers(biomarker_config(1), 0, 1).run(experiment, incremental=True)
+    lines = (tmp_path / 'biomarkers.csv').read_text().splitlines()
+    # APA is kept, Max_Cai in other unit is not
+    assert lines[0] == 'directory, MDP (mV), CL (s), APD90 (s), Max_Cai (mol), APA (mV)'
+    assert [line.split(', ')[1] for line in lines[1:]] == ['-123.0', '-123.0', lines[3].split(', ')[1]]
+    assert lines[3].split(', ')[1] != '-123.0' and lines[3].split(', ')[5] == 'nan'
+    assert 'nan' not in lines[1] + lines[2]
+    assert (pathlib.Path(experiment.get_directory(0)) / 'biomarkers.csv').read_text().splitlines()[0] == lines[0][len('directory, '):]
+
+    cal.Calibration([{'file': 'biomarkers.csv'}, {'protocol': 'nonan', 'fail_path': 'fail.csv', 'success_path': 'success.csv'}], experiment, 0, 1).run()
+    # reused and calculated columns are both found by calibration, only the cell without beats fails
+    assert (tmp_path / 'success.csv').read_text() == 'cell_1\ncell_2\n'
+    assert (tmp_path / 'fail.csv').read_text() == 'cell_3\n'
+
+
+def test_merge_patches_with_different_columns(tmp_path):
+    content = {'experiment': [{'name': 'cell_#', 'id': 'exp', 'model': 'npy_model', 'cwd': str(tmp_path / 'exp'), 'parametrization': 'latin_hybercube',
+                               'cells': 4, 'parameter_count': 1, 'manifest': 'manifest.txt'}],
+               'biomarkers': biomarker_config(1)}
+    patches = ['directory, MDP (mV), CL (s)\ncell_1, -70.0, 0.8\ncell_2, -71.0, 0.9\n',
+               'directory, APA (mV), MDP (mV)\ncell_3, 100.0, -72.0\ncell_4, 101.0, -73.0\n']
+    for patch_idx, text in enumerate(patches):
+        cwd = pathlib.Path(exp.Experiment(content['experiment'][0], patch_idx, 2, 0).cwd)
+        cwd.mkdir(parents=True)
+        (cwd / biomarker.Biomarkers(content['biomarkers'], patch_idx, 2).patch_file).write_text(text)
+    (tmp_path / 'exp').mkdir() # made by merging the experiments
+
+    merge.Merge(content, 2, True, False).merge_biomarkers()
+
+    assert (tmp_path / 'exp' / 'biomarkers.csv').read_text() == ('directory, MDP (mV), CL (s), APA (mV)\n'
+                                                                 'cell_1, -70.0, 0.8, nan\n'
+                                                                 'cell_2, -71.0, 0.9, nan\n'
+                                                                 'cell_3, -72.0, nan, 100.0\n'
+                                                                 'cell_4, -73.0, nan, 101.0\n')
@@ -0,0 +1,166 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parents[2]))
+import src.biomarker as biomarker
+import numpy as np
+import pytest
+
+
+def make_data(beats: int = 12, cl: float = 0.8, dt: float = 0.0005) -> dict:
+    # Simple action potential and calcium transient shapes, repeating with cycle length `cl`
+    t = np.arange(0, beats * cl, dt)
+    phase = np.mod(t, cl)
+    upstroke = np.clip((phase - 0.05) / 0.01, 0, 1)
+    repolarization = np.clip((phase - 0.06) / (cl - 0.06), 0, 1) ** 2.5
+    vm = -0.075 + 0.005 * phase / cl + 0.11 * upstroke * (1 - repolarization)
+    since = np.maximum(phase - 0.06, 0)
+    cai = 2e-5 + 4e-4 * (1 - np.exp(-since / 0.02)) * np.exp(-since / 0.15)
+    return {biomarker.TIME: t, biomarker.VM: vm, biomarker.CALSIUM: cai}
+
+
+NAMES = ['MDP', 'APA', 'CL', 'Rate_AP', 'APD30', 'APD40', 'APD70', 'APD80', 'APD90', 'RAPP_APD',
+         'Max_Cai', 'RT1050', 'DT9010', 'RT10Peak', 'CAI_DURATION', 'CTD30', 'CTD50']
+
+
+def calculate(names: list) -> dict:
+    window = biomarker.Window(make_data())
+    values = {}
+    for name in names:
+        try:
+            values[name] = window.result(biomarker.BIOMARKERS[name])
+        except Exception:
+            values[name] = float('nan')
+    return values
+
+
+@pytest.mark.parametrize('names', [NAMES, NAMES[::-1], ['RAPP_APD'] + NAMES])
+def test_results_do_not_depend_on_order(names):
+    expected = calculate(NAMES)
+    values = calculate(names)
+    for name in NAMES:
+        assert values[name] == expected[name], name
+
+
+def test_dependencies_are_computed_once(monkeypatch):
+    window = biomarker.Window(make_data())
+    calls = []
+    original = biomarker.apd_kernel
+    def counting(window, levels):
+        calls.extend(levels)
+        return original(window, levels)
+    monkeypatch.setattr(biomarker, 'apd_kernel', counting)
+    for name in ['RAPP_APD', 'APD30', 'APD80', 'RAPP_APD']:
+        window.result(biomarker.BIOMARKERS[name])
+    assert sorted(calls) == [30, 40, 70, 80]
+    assert np.isfinite(window.result(biomarker.BIOMARKERS['RAPP_APD']))
+
+
+def test_requested_apd_levels_are_computed_together(monkeypatch):
+    biomarkers = [biomarker.BIOMARKERS[name] for name in ['APD90', 'RAPP_APD']]
+    window = biomarker.Window(make_data(), biomarkers)
+    calls = []
+    original = biomarker.apd_kernel
+    def counting(window, levels):
+        calls.append(levels)
+        return original(window, levels)
+    monkeypatch.setattr(biomarker, 'apd_kernel', counting)
+    for bm in biomarkers:
+        window.result(bm)
+    assert calls == [[30, 40, 70, 80, 90]]
+    assert window.result(biomarkers[0]) == calculate(['APD90'])['APD90']
+
+
+def test_rapp_apd_legacy_first_beat():
+    window = biomarker.Window(make_data())
+    apds = [apd.beat_values(window) for apd in biomarker.RAPP_APD().dependencies()]
+    # mean APD in the first beat only for levels not configured before RAPP_APD
+    legacy = biomarker.RAPP_APD.legacy(['MDP', 'APD40'])
+    assert legacy.mean_first_beat == [30, 70, 80]
+    first = [apd.mean() if N != 40 else apd[0] for apd, N in zip(apds, [30, 40, 70, 80])]
+    values = (apds[0]-apds[1])/(apds[2]-apds[3])
+    values[0] = (first[0]-first[1])/(first[2]-first[3])
+    assert window.result(legacy) == pytest.approx(np.mean(values))
+    assert biomarker.Biomarkers([{'target': 'exp', 'file': 'biomarkers.csv'}, {'biomarker': 'APD40'},
+                                 {'biomarker': 'RAPP_APD', 'legacy_first_beat': True}], 0, 1).biomarkers[1].mean_first_beat == [30, 70, 80]
+
+
+def test_first_last_in_ranges():
+    condition = np.array([0, 1, 1, 0, 0, 1, 0, 1], dtype=bool)
+    first, last = biomarker._first_last(condition, np.array([0, 3, 3, 6]), np.array([3, 5, 8, 6]))
+    assert first.tolist() == [1, -1, 5, -1]
+    assert last.tolist() == [2, -1, 7, -1]
+
+
+def test_relax_time_is_interpolated():
+    data = make_data()
+    phase = np.mod(data[biomarker.TIME], 0.8)
+    # force peaks at 0.2 s into the beat and relaxes linearly to zero in 0.2 s
+    data[biomarker.FORCE] = np.clip(np.where(phase < 0.2, phase / 0.2, 1 - (phase - 0.2) / 0.2), 0, 1)
+    window = biomarker.Window(data)
+    assert window.result(biomarker.BIOMARKERS['relaxTime50']) == pytest.approx(0.1, abs=1e-6)
+    assert window.result(biomarker.BIOMARKERS['peakTension']) == pytest.approx(1.0, abs=1e-6)
+
+
+@pytest.mark.parametrize('beat_count', [2, 9])
+def test_tail_detection_finds_same_beats(monkeypatch, beat_count):
+    monkeypatch.setattr(biomarker, 'TAIL_CHUNK', 1000)
+    data = make_data(beats=40)
+    full = biomarker.Window(data, beat_count=beat_count, detection=biomarker.DETECTION_FULL)
+    tail = biomarker.Window(data, beat_count=beat_count, detection=biomarker.DETECTION_TAIL)
+    for table in ['ap_table', 'cai_table']:
+        assert np.array_equal(getattr(full, table)().start, getattr(tail, table)().start)
+        assert np.array_equal(getattr(full, table)().end, getattr(tail, table)().end)
+    assert tail.result(biomarker.BIOMARKERS['APD90']) == full.result(biomarker.BIOMARKERS['APD90'])
+
+
+def test_segmentation_is_reused(tmp_path, monkeypatch):
+    file = str(tmp_path / biomarker.SEGMENTATION_FILE)
+    window = biomarker.Window(make_data())
+    expected = [window.result(biomarker.BIOMARKERS[name]) for name in NAMES]
+    window.save_segmentation(file)
+
+    def no_peaks(x, **kwargs):
+        raise AssertionError('beats were detected again')
+    monkeypatch.setattr(biomarker, 'find_peaks', no_peaks)
+    window = biomarker.Window(make_data())
+    assert window.load_segmentation(file)
+    assert [window.result(biomarker.BIOMARKERS[name]) for name in NAMES] == expected
+    assert not window.segmentation_changed
+
+    # other data or detection settings do not use the stored beats
+    assert not biomarker.Window(make_data(cl=0.7)).load_segmentation(file)
+    assert not biomarker.Window(make_data(), beat_count=5).load_segmentation(file)
+
+
+def test_segmentation_tables_are_keyed_on_their_signals(tmp_path):
+    file = str(tmp_path / biomarker.SEGMENTATION_FILE)
+    data = make_data()
+    ap_data = {name: data[name] for name in [biomarker.TIME, biomarker.VM]}
+    window = biomarker.Window(ap_data)
+    apd = window.result(biomarker.BIOMARKERS['APD90'])
+    window.save_segmentation(file)
+
+    # new biomarker loads Cai too, stored Vm beats are still used
+    window = biomarker.Window(data)
+    assert window.load_segmentation(file)
+    assert window.ap is not None and window.cai is None
+    assert window.result(biomarker.BIOMARKERS['APD90']) == apd
+    max_cai = window.result(biomarker.BIOMARKERS['Max_Cai'])
+    window.save_segmentation(file)
+
+    # run needing only Cai keeps the stored Vm beats
+    cai_data = {name: data[name] for name in [biomarker.TIME, biomarker.CALSIUM]}
+    window = biomarker.Window(cai_data)
+    assert window.load_segmentation(file)
+    assert window.ap is None and window.cai is not None
+    assert window.result(biomarker.BIOMARKERS['Max_Cai']) == max_cai
+    window.save_segmentation(file)
+    window = biomarker.Window(data)
+    assert window.load_segmentation(file)
+    assert window.ap is not None and window.cai is not None
+
+    # stimulus changes how the Vm beats are found, Cai beats stay
+    window = biomarker.Window({**data, biomarker.STIM: np.zeros_like(data[biomarker.TIME])})
+    assert window.load_segmentation(file)
+    assert window.ap is None and window.cai is not None
@@ -0,0 +1,11 @@
+# Stand-in for an in-process python model
+import numpy as np
+
+
+def simulate(parameters):
+    time = np.linspace(0, 1, 1000)
+    return {'time': time, 'Vm': parameters[0] * np.sin(2 * np.pi * parameters[1] * time)}
+
+
+def not_a_model(parameters):
+    return parameters
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# Stand-in for a model run as a command.
+# `stand_in_model.py <parameter 1> <parameter 2> ...` "simulates" one cell in the working directory,
+# `stand_in_model.py --batch <file>` every cell of the batch file, one `<cell directory>, <parameters>` per line.
+import os
+import sys
+import time
+
+
+def simulate(directory, parameters):
+    # later cells finish first when run concurrently
+    time.sleep(0.2 * (1 - parameters[0]))
+    with open(os.path.join(directory, 'result.txt'), 'w') as f:
+        f.write(f'{sum(parameters)}\n')
+
+
+if sys.argv[1] == '--batch':
+    with open(sys.argv[2]) as f:
+        for line in f:
+            directory, *parameters = line.strip().split(', ')
+            simulate(directory, [float(par) for par in parameters])
+    print(f'simulated batch {sys.argv[2]}')
+else:
+    simulate('.', [float(par) for par in sys.argv[1:]])
+    print(f'simulated {" ".join(sys.argv[1:])}')
@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+# Stand-in for a persistent model worker (e.g. matlab session running a loop).
+# Reads one json request per line, "simulates" the command and answers with the done token.
+import json
+import os
+import sys
+import time
+
+for line in sys.stdin:
+    request = json.loads(line)
+    parameters = [float(par) for par in request['command'].split()]
+    if parameters[0] < 0:
+        time.sleep(60) # stuck simulation
+    with open(os.path.join(request['cwd'], 'result.txt'), 'w') as f:
+        f.write(f'{os.getpid()} {sum(parameters)}\n')
+    print(f'simulated {request["command"]}')
+    print('POMTOOL_DONE 0', flush=True)
@@ -0,0 +1,67 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parents[2]))
+import src.cache as cache
+import src.workspace as workspace
+import os
+
+
+def make_cell(directory: pathlib.Path, content: str) -> str:
+    directory.mkdir(parents=True)
+    (directory / 'res.txt').write_text(content)
+    return str(directory)
+
+
+def test_fetch_stored(tmp_path):
+    result_cache = cache.ResultCache(str(tmp_path / 'cache'), '1MB')
+    key = cache.ResultCache.key('model 1.0 2.0')
+    assert not result_cache.fetch(key, str(tmp_path / 'cell_2'))
+
+    result_cache.store(key, make_cell(tmp_path / 'cell_1', 'result'))
+
+    assert result_cache.fetch(key, str(tmp_path / 'cell_2'))
+    assert (tmp_path / 'cell_2' / 'res.txt').read_text() == 'result'
+
+
+def test_entries_are_not_shared_with_writers(tmp_path):
+    result_cache = cache.ResultCache(str(tmp_path / 'cache'), '1MB')
+    key = cache.ResultCache.key('model 1.0 2.0')
+    result_cache.store(key, make_cell(tmp_path / 'cell_1', 'result'))
+    entry = tmp_path / 'cache' / 'entries' / key / 'res.txt'
+    assert not os.stat(entry).st_mode & 0o222
+
+    # stored cell is rewritten in place
+    (tmp_path / 'cell_1' / 'res.txt').write_text('changed')
+    assert entry.read_text() == 'result'
+
+    # fetched cell shares the entry until the link is broken
+    assert result_cache.fetch(key, str(tmp_path / 'cell_2'))
+    assert os.path.samefile(tmp_path / 'cell_2' / 'res.txt', entry)
+    workspace.unshare(str(tmp_path / 'cell_2' / 'res.txt'))
+    (tmp_path / 'cell_2' / 'res.txt').write_text('changed')
+    assert entry.read_text() == 'result'
+    assert result_cache.fetch(key, str(tmp_path / 'cell_3'))
+    assert (tmp_path / 'cell_3' / 'res.txt').read_text() == 'result'
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    result_cache = cache.ResultCache(str(tmp_path / 'cache'), 25)
+    keys = [cache.ResultCache.key(f'model {i}') for i in range(3)]
+    result_cache.store(keys[0], make_cell(tmp_path / 'cell_0', 'x' * 10))
+    result_cache.store(keys[1], make_cell(tmp_path / 'cell_1', 'x' * 10))
+    # second one was used long ago, first one just now
+    os.utime(tmp_path / 'cache' / 'used' / keys[1], (0, 0))
+    assert result_cache.fetch(keys[0], str(tmp_path / 'fetched'))
+
+    result_cache.store(keys[2], make_cell(tmp_path / 'cell_2', 'x' * 10))
+
+    assert result_cache.fetch(keys[0], str(tmp_path / 'fetched'))
+    assert not result_cache.fetch(keys[1], str(tmp_path / 'fetched'))
+    assert result_cache.fetch(keys[2], str(tmp_path / 'fetched'))
+
+
+def test_parse_size():
+    assert cache.parse_size(100) == 100
+    assert cache.parse_size('10GB') == 10 ** 10
+    assert cache.parse_size('1.5 MB') == 1500000
@@ -0,0 +1,87 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parents[2]))
+import src.experiment as exp
+import src.model as mod
+import os
+import shutil
+
+STAND_IN_MODEL = pathlib.Path(__file__).parent / 'stand_in_model.py'
+
+
+def make_experiment(cwd: pathlib.Path, jobs: int = 1, batch: int = 1) -> exp.Experiment:
+    return exp.Experiment({'name': 'cell_#', 'id': 'experiment', 'model': 'stand_in', 'cwd': str(cwd),
+                           'parametrization': 'latin_hybercube', 'cells': 5, 'parameter_count': 2,
+                           'manifest': 'simulation_manifest.csv', 'jobs': jobs, 'batch': batch}, 0, 1, 0)
+
+
+def make_models(batch: bool = False, cache: pathlib.Path = None) -> mod.Models:
+    args = {'id': 'stand_in', 'exec': f'{sys.executable} {STAND_IN_MODEL}'}
+    if cache != None:
+        args['cache'] = str(cache)
+    return mod.Models([args, {'par': '--batch %batch%' if batch else '%1% %2%'}])
+
+
+def cell_files(cwd: pathlib.Path) -> dict:
+    return {str(path.relative_to(cwd)): path.read_bytes() for path in sorted(cwd.rglob('*')) if path.is_file()}
+
+
+def test_jobs_give_same_cells(tmp_path):
+    for jobs in [1, 3]:
+        make_experiment(tmp_path / f'jobs_{jobs}', jobs).run(make_models())
+
+    serial = cell_files(tmp_path / 'jobs_1')
+    assert sorted(serial) == sorted(cell_files(tmp_path / 'jobs_3'))
+    assert [name for name in serial if name.endswith('result.txt')] == [f'cell_{i}/result.txt' for i in range(1, 6)]
+    # `cmd.txt` and outputs of the model are the same, whichever run finished first
+    assert serial == cell_files(tmp_path / 'jobs_3')
+    assert (tmp_path / 'jobs_1' / 'simulation_manifest.csv').read_bytes() == (tmp_path / 'jobs_3' / 'simulation_manifest.csv').read_bytes()
+
+
+def test_batch_cells(tmp_path):
+    experiment = make_experiment(tmp_path / 'batch', batch=2)
+    experiment.run(make_models(batch=True))
+    make_experiment(tmp_path / 'single').run(make_models())
+    parameters = experiment._generate_parameters()
+
+    # 5 cells in batches of 2, last batch has only one cell
+    batches = {'batch_cell_1': [0, 1], 'batch_cell_3': [2, 3], 'batch_cell_5': [4]}
+    assert sorted(path.name for path in (tmp_path / 'batch').glob('batch_*')) == sorted(batches)
+    for batch_directory, cells in batches.items():
+        batch_file = tmp_path / 'batch' / batch_directory / 'batch.csv'
+        assert batch_file.read_text() == ''.join(', '.join([str(tmp_path / 'batch' / f'cell_{idx + 1}')] + [str(par) for par in parameters[idx]]) + '\n' for idx in cells)
+        command = f'{sys.executable} {STAND_IN_MODEL} --batch {batch_file}\n'
+        assert (tmp_path / 'batch' / batch_directory / 'cmd.txt').read_text() == command
+        assert (tmp_path / 'batch' / batch_directory / 'stdout.txt').read_text() == f'simulated batch {batch_file}\n'
+        for idx in cells:
+            assert (tmp_path / 'batch' / f'cell_{idx + 1}' / 'cmd.txt').read_text() == command
+            assert (tmp_path / 'batch' / f'cell_{idx + 1}' / 'returncode.txt').read_text() == '0\n'
+    for idx in range(5):
+        assert (tmp_path / 'batch' / f'cell_{idx + 1}' / 'result.txt').read_bytes() == (tmp_path / 'single' / f'cell_{idx + 1}' / 'result.txt').read_bytes()
+    assert (tmp_path / 'batch' / 'simulation_manifest.csv').read_bytes() == (tmp_path / 'single' / 'simulation_manifest.csv').read_bytes()
+
+
+def test_batch_only_runs_cache_misses(tmp_path):
+    models = make_models(batch=True, cache=tmp_path / 'cache')
+    experiment = make_experiment(tmp_path / 'first', batch=5)
+    experiment.run(models)
+    parameters = experiment._generate_parameters()
+    # second and fourth cell are not in the cache anymore
+    for idx in [1, 3]:
+        key = models.model('stand_in')._cache_key(parameters[idx])
+        shutil.rmtree(tmp_path / 'cache' / 'entries' / key)
+        os.remove(tmp_path / 'cache' / 'used' / key)
+
+    make_experiment(tmp_path / 'second', batch=3).run(make_models(batch=True, cache=tmp_path / 'cache'))
+
+    # batches are [1, 2, 3] and [4, 5], model is launched only for the misses and batch is named after the first miss
+    assert sorted(path.name for path in (tmp_path / 'second').glob('batch_*')) == ['batch_cell_2', 'batch_cell_4']
+    for batch_directory, idx in [('batch_cell_2', 1), ('batch_cell_4', 3)]:
+        batch_file = tmp_path / 'second' / batch_directory / 'batch.csv'
+        assert batch_file.read_text() == ', '.join([str(tmp_path / 'second' / f'cell_{idx + 1}')] + [str(par) for par in parameters[idx]]) + '\n'
+    for idx in range(5):
+        assert (tmp_path / 'second' / f'cell_{idx + 1}' / 'result.txt').read_bytes() == (tmp_path / 'first' / f'cell_{idx + 1}' / 'result.txt').read_bytes()
+    # misses are stored again
+    assert len(list((tmp_path / 'cache' / 'entries').iterdir())) == 5
+    assert (tmp_path / 'second' / 'simulation_manifest.csv').read_bytes() == (tmp_path / 'first' / 'simulation_manifest.csv').read_bytes()
@@ -0,0 +1,139 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parents[2]))
+import src.loader as loader
+import src.model as mod
+import numpy as np
+import os
+import pytest
+
+
+def test_binary_default_is_float64(tmp_path):
+    data = np.linspace(0, 1, 11)
+    data.tofile(tmp_path / 'vm.bin')
+    loaded = loader.binary(str(tmp_path / 'vm.bin'), {'val': 'Vm'})
+    assert np.array_equal(loaded, data)
+
+
+def test_binary_interleaved_column(tmp_path):
+    data = np.arange(12, dtype='>f4').reshape(-1, 3)
+    with open(tmp_path / 'res.bin', 'wb') as f:
+        f.write(b'header__')
+        f.write(data.tobytes())
+    value_data = {'val': 'Cai', 'dtype': 'float32', 'byteorder': 'big', 'offset': 8, 'shape': [-1, 3], 'col': 2}
+    assert np.array_equal(loader.binary(str(tmp_path / 'res.bin'), value_data), data[:, 1])
+
+
+def test_binary_2d_needs_column(tmp_path):
+    np.zeros(6).tofile(tmp_path / 'res.bin')
+    with pytest.raises(ValueError):
+        loader.binary(str(tmp_path / 'res.bin'), {'val': 'Vm', 'shape': [2, 3]})
+
+
+@pytest.mark.parametrize('save', [np.savez, np.savez_compressed])
+def test_numpy_archive_reads_requested_arrays(tmp_path, save):
+    values = np.arange(20.0).reshape(-1, 2)
+    save(tmp_path / 'res.npz', val=values, time=np.arange(10.0), junk=np.zeros(100))
+    arrays = loader.numpy(str(tmp_path / 'res.npz'), ['val', 'time'])
+    assert sorted(arrays) == ['time', 'val']
+    assert np.array_equal(arrays['val'], values)
+    assert np.array_equal(loader.select(arrays['val'], {'val': 'Cai', 'col': 2}, 'res.npz'), values[:, 1])
+    with pytest.raises(KeyError):
+        loader.numpy(str(tmp_path / 'res.npz'), ['Vm'])
+
+
+def test_matlab_reads_requested_variables(tmp_path):
+    import scipy.io
+    scipy.io.savemat(tmp_path / 'res.mat', {'val': np.ones((5, 2)), 'time': np.arange(5.0), 'junk': np.zeros(100)})
+    data = loader.matlab(str(tmp_path / 'res.mat'), ['time'])
+    assert 'time' in data and 'val' not in data and 'junk' not in data
+
+
+def write_trace(tmp_path, rows: int) -> np.ndarray:
+    data = np.column_stack([np.arange(rows) * 0.5, np.sin(np.arange(rows)), np.cos(np.arange(rows))])
+    np.savetxt(tmp_path / 'trace.dat', data)
+    (tmp_path / 'header.txt').write_text('Vm\nCai\n')
+    return data
+
+
+def test_tail_lines(tmp_path):
+    data = write_trace(tmp_path, 20000)
+    lines = loader.tail_lines(str(tmp_path / 'trace.dat'), count=3)
+    assert np.allclose(np.loadtxt(lines), data[-3:])
+    lines = loader.tail_lines(str(tmp_path / 'trace.dat'), span=2.0)
+    assert np.allclose(np.loadtxt(lines), data[-5:])
+    assert len(loader.tail_lines(str(tmp_path / 'trace.dat'), count=30000)) == 20000
+
+
+def test_opencarp_trace_tail(tmp_path):
+    data = write_trace(tmp_path, 100)
+    trace = loader.opencarp_trace(str(tmp_path / 'trace.dat'), str(tmp_path / 'header.txt'), ['Cai'], tail_samples=10)
+    assert np.allclose(trace['Cai'], data[-10:, 2])
+
+
+def test_opencarp_trace_parses_requested_columns(tmp_path, monkeypatch):
+    write_trace(tmp_path, 100)
+    parsed_columns = []
+    loadtxt = np.loadtxt
+    def recording_loadtxt(*args, **kwargs):
+        parsed_columns.append(kwargs['usecols'])
+        return loadtxt(*args, **kwargs)
+    monkeypatch.setattr(np, 'loadtxt', recording_loadtxt)
+
+    trace = loader.opencarp_trace(str(tmp_path / 'trace.dat'), str(tmp_path / 'header.txt'), ['time', 'Cai'])
+
+    assert parsed_columns == [[0, 2]]
+    assert list(trace) == ['time', 'Cai']
+    whole = np.genfromtxt(tmp_path / 'trace.dat')
+    assert np.array_equal(trace['time'], whole[:, 0])
+    assert np.array_equal(trace['Cai'], whole[:, 2])
+
+
+def test_opencarp_trace_sidecar(tmp_path, monkeypatch):
+    data = write_trace(tmp_path, 100)
+    trace_file, header_file = str(tmp_path / 'trace.dat'), str(tmp_path / 'header.txt')
+    sidecar_file = tmp_path / 'trace.dat.2.npy'
+
+    trace = loader.opencarp_trace(trace_file, header_file, ['Cai'], sidecar=True)
+    assert sidecar_file.exists()
+    assert not (tmp_path / 'trace.dat.1.npy').exists()
+    assert np.array_equal(np.load(sidecar_file), data[:, 2])
+    assert np.array_equal(trace['Cai'], data[:, 2])
+
+    # second read does not parse the trace
+    loadtxt = np.loadtxt
+    def failing_loadtxt(*args, **kwargs):
+        raise AssertionError('trace parsed again')
+    monkeypatch.setattr(np, 'loadtxt', failing_loadtxt)
+    trace = loader.opencarp_trace(trace_file, header_file, ['Cai'], sidecar=True)
+    assert isinstance(trace['Cai'], np.memmap)
+    assert np.array_equal(trace['Cai'], data[:, 2])
+
+    # rerun of the model makes the sidecar stale
+    monkeypatch.setattr(np, 'loadtxt', loadtxt)
+    data = write_trace(tmp_path, 50)
+    mtime = os.path.getmtime(sidecar_file) + 10
+    os.utime(trace_file, (mtime, mtime))
+    trace = loader.opencarp_trace(trace_file, header_file, ['Cai'], sidecar=True)
+    assert np.array_equal(trace['Cai'], data[:, 2])
+    assert np.array_equal(np.load(sidecar_file), data[:, 2])
+
+
+@pytest.mark.parametrize('tail', [{'tail_samples': 5}, {'tail_time': 0.002}])
+def test_model_reads_tail(tmp_path, tail):
+    time = np.arange(100) * 0.5 # ms
+    time.tofile(tmp_path / 'time.bin')
+    np.arange(100.0).tofile(tmp_path / 'vm.bin')
+    model = mod.Model([{'id': 'tail_model', 'exec': 'true', **tail},
+                       {'val': 'time', 'unit': 'ms', 'method': 'binary', 'file': 'time.bin'},
+                       {'val': 'Vm', 'unit': 'mV', 'method': 'binary', 'file': 'vm.bin'}])
+    data = model.get_data(str(tmp_path), ['Vm'], [])
+    assert list(data) == ['Vm']
+    assert np.allclose(data['Vm'], np.arange(95.0, 100.0) * 1e-3)
+
+
+def test_model_tail_time_needs_time():
+    with pytest.raises(ValueError):
+        mod.Model([{'id': 'tail_model', 'exec': 'true', 'tail_time': 1},
+                   {'val': 'Vm', 'unit': 'mV', 'method': 'binary', 'file': 'vm.bin'}])
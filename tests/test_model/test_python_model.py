@@ -0,0 +1,64 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parents[2]))
+import src.model as mod
+import numpy as np
+import pytest
+
+
+def python_model(function: str) -> mod.Model:
+    return mod.Model([{'id': 'python_model', 'exec': f'python:python_model:{function}'},
+                      {'val': 'time', 'unit': 's', 'method': 'python'},
+                      {'val': 'Vm', 'unit': 'mV', 'method': 'python'}])
+
+
+@pytest.fixture
+def model_path(monkeypatch):
+    monkeypatch.syspath_prepend(str(pathlib.Path(__file__).parent))
+
+
+def test_python_model_data(tmp_path, model_path):
+    model = python_model('simulate')
+    model.run(str(tmp_path / 'cell_1'), np.array([2.0, 3.0]))
+    data = model.get_data(str(tmp_path / 'cell_1'), ['time', 'Vm'], [])
+
+    time = np.linspace(0, 1, 1000)
+    assert np.allclose(data['time'], time)
+    assert np.allclose(data['Vm'], 2e-3 * np.sin(2 * np.pi * 3.0 * time)) # mV -> V
+    assert (tmp_path / 'cell_1' / 'cmd.txt').read_text() == 'python:python_model:simulate(2.0, 3.0)\n'
+
+
+def test_python_model_outputs_are_stored(tmp_path, model_path):
+    model = python_model('simulate')
+    model.run(str(tmp_path / 'cell_1'), np.array([2.0, 3.0]))
+    first = model.get_data(str(tmp_path / 'cell_1'), ['time', 'Vm'], [])
+
+    # e.g. biomarkers in other process, or a later run with --skip-experiment
+    data = python_model('simulate').get_data(str(tmp_path / 'cell_1'), ['time', 'Vm'], [])
+    assert all(np.array_equal(data[name], first[name]) for name in first)
+    assert (tmp_path / 'cell_1' / mod.PYTHON_FILE).exists()
+    model.delete_data(str(tmp_path / 'cell_1'))
+    assert not (tmp_path / 'cell_1' / mod.PYTHON_FILE).exists()
+
+
+def test_python_model_missing_output(tmp_path, model_path):
+    model = mod.Model([{'id': 'python_model', 'exec': 'python:python_model:simulate'},
+                       {'val': 'Cai', 'unit': 'mmol', 'method': 'python'}])
+    model.run(str(tmp_path / 'cell_1'), np.array([2.0, 3.0]))
+    with pytest.raises(KeyError):
+        model.get_data(str(tmp_path / 'cell_1'), ['Cai'], [])
+
+
+def test_python_model_wrong_return(tmp_path, model_path):
+    model = python_model('not_a_model')
+    with pytest.raises(ValueError):
+        model.run(str(tmp_path / 'cell_1'), np.array([2.0, 3.0]))
+
+
+def test_python_model_exec_format():
+    with pytest.raises(ValueError):
+        mod.Model([{'id': 'python_model', 'exec': 'python:simulate'}])
+    # python vals are only given by python models
+    with pytest.raises(ValueError):
+        mod.Model([{'id': 'command_model', 'exec': 'true'}, {'val': 'Vm', 'unit': 'mV', 'method': 'python'}])
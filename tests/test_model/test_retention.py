@@ -0,0 +1,60 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parents[2]))
+import src.experiment as exp
+import src.model as mod
+import numpy as np
+import pytest
+
+
+def npy_model() -> mod.Model:
+    return mod.Model([{'id': 'npy_model', 'exec': 'true'},
+                      {'val': 'time', 'unit': 'ms', 'method': 'numpy', 'file': 'time.npy'},
+                      {'val': 'Vm', 'unit': 'mV', 'method': 'numpy', 'file': 'vm.npy'},
+                      {'val': 'Cai', 'unit': 'mmol', 'method': 'numpy', 'file': 'cai.npy'}])
+
+
+def write_outputs(directory: pathlib.Path) -> None:
+    directory.mkdir(parents=True, exist_ok=True)
+    np.save(directory / 'time.npy', np.arange(20.0))
+    np.save(directory / 'vm.npy', np.linspace(-80, 20, 20))
+    np.save(directory / 'cai.npy', np.ones(20))
+
+
+def test_compact_replaces_raw_outputs(tmp_path):
+    model = npy_model()
+    write_outputs(tmp_path)
+    expected = model.get_data(str(tmp_path), ['time', 'Vm'], [])
+    model.compact_data(tmp_path, ['time', 'Vm'], [])
+    assert sorted(path.name for path in tmp_path.iterdir()) == [mod.COMPACT_FILE]
+
+    data = model.get_data(str(tmp_path), ['time'], ['Vm', 'Cai'])
+    assert sorted(data) == ['Vm', 'time']
+    assert all(np.array_equal(data[name], expected[name]) for name in expected)
+    with pytest.raises(ValueError):
+        model.get_data(str(tmp_path), ['Cai'], [])
+
+
+def make_experiment(tmp_path, retention: str) -> exp.Experiment:
+    experiment = exp.Experiment({'name': 'cell_#', 'id': 'exp', 'model': 'npy_model', 'cwd': str(tmp_path), 'parametrization': 'latin_hybercube',
+                                 'cells': 2, 'parameter_count': 1, 'manifest': 'manifest.txt', 'retention': retention}, 0, 1, 0)
+    experiment.model = npy_model()
+    for idx in experiment.patch:
+        write_outputs(pathlib.Path(experiment.get_directory(idx)))
+    return experiment
+
+
+@pytest.mark.parametrize('retention, kept', [('keep', [True, True]), ('delete', [False, False]),
+                                             ('keep_calibrated', [True, False]), ('keep_failed', [False, True])])
+def test_retention(tmp_path, retention, kept):
+    experiment = make_experiment(tmp_path, retention)
+    for idx, calibrated in zip(experiment.patch, [True, False]):
+        experiment.biomarkers_done(idx, ['time', 'Vm'], [])
+        experiment.calibration_done(idx, calibrated)
+    assert [(pathlib.Path(experiment.get_directory(idx)) / 'vm.npy').exists() for idx in experiment.patch] == kept
+
+
+def test_unknown_retention(tmp_path):
+    with pytest.raises(ValueError):
+        make_experiment(tmp_path, 'archive')
@@ -0,0 +1,47 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parents[2]))
+import src.scheduler as scheduler
+import time
+
+
+def test_return_code(tmp_path):
+    return_code = scheduler.run(scheduler.run_command('echo out; echo err >&2; exit 3', str(tmp_path)))
+
+    assert return_code == 3
+    assert (tmp_path / 'returncode.txt').read_text() == '3\n'
+    assert (tmp_path / 'stdout.txt').read_text() == 'out\n'
+    assert (tmp_path / 'stderr.txt').read_text() == 'err\n'
+
+
+def test_timeout_kills_process_group(tmp_path):
+    start = time.monotonic()
+    # `sleep` is child of the shell, it has to be killed too or we would wait for it
+    return_code = scheduler.run(scheduler.run_command('sleep 60; echo done', str(tmp_path), timeout=0.5))
+
+    assert time.monotonic() - start < 10
+    assert return_code == scheduler.KILLED
+    assert (tmp_path / 'stdout.txt').read_text() == ''
+
+
+def test_retries(tmp_path):
+    # fails on the first two tries
+    command = 'echo x >> tries.txt; test $(wc -l < tries.txt) -ge 3'
+    return_code = scheduler.run(scheduler.run_command(command, str(tmp_path), retries=2))
+
+    assert return_code == 0
+    assert (tmp_path / 'tries.txt').read_text() == 'x\nx\nx\n'
+
+
+def test_stuck_run_does_not_block_others(tmp_path):
+    directories = [tmp_path / f'cell_{i}' for i in range(4)]
+    for directory in directories:
+        directory.mkdir()
+    commands = ['sleep 60'] + ['true'] * 3
+    start = time.monotonic()
+    return_codes = scheduler.run_all([scheduler.run_command(command, str(directory), timeout=2)
+                                      for command, directory in zip(commands, directories)], jobs=2)
+
+    assert time.monotonic() - start < 10
+    assert return_codes == [scheduler.KILLED, 0, 0, 0]
@@ -0,0 +1,23 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parents[2]))
+import src.utility as utility
+import numpy as np
+import pytest
+import scimath.units.api as API
+
+
+@pytest.mark.parametrize('unit', list(utility.unit_to_scimath.keys()))
+def test_conversion_matches_scimath(unit):
+    data = np.linspace(-5, 5, 101)
+    expected = API.convert(data, utility.unit_to_scimath[unit], utility.default_unit_of[unit])
+    assert np.array_equal(utility.convert_to_default(data, unit), expected)
+    assert np.array_equal(utility.convert_to_default(data.copy(), unit, in_place=True), expected)
+    assert utility.convert_from_default(0.25, unit) == API.convert(0.25, utility.default_unit_of[unit], utility.unit_to_scimath[unit])
+
+
+def test_in_place_conversion_reuses_array():
+    data = np.array([1.0, 2.0])
+    assert utility.convert_to_default(data, 'ms', in_place=True) is data
+    assert np.array_equal(data, [0.001, 0.002])
@@ -0,0 +1,66 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parents[2]))
+import src.model as mod
+import numpy as np
+
+STAND_IN_WORKER = pathlib.Path(__file__).parent / 'stand_in_worker.py'
+
+
+def worker_model(timeout=None) -> mod.Model:
+    args = {'id': 'worker_model', 'exec': f'{sys.executable} {STAND_IN_WORKER}', 'mode': 'worker'}
+    if timeout:
+        args['timeout'] = timeout
+    return mod.Model([args, {'par': '%1% %2%'}])
+
+
+def read_result(directory: pathlib.Path) -> list:
+    return (directory / 'result.txt').read_text().split()
+
+
+def test_worker_result(tmp_path):
+    model = worker_model()
+    try:
+        model.run(str(tmp_path / 'cell_1'), np.array([1.0, 2.0]))
+    finally:
+        model.close()
+
+    assert float(read_result(tmp_path / 'cell_1')[1]) == 3.0
+    assert (tmp_path / 'cell_1' / 'cmd.txt').read_text() == '1.0 2.0\n'
+    assert (tmp_path / 'cell_1' / 'stdout.txt').read_text() == 'simulated 1.0 2.0\n'
+
+
+def test_worker_is_reused(tmp_path):
+    model = worker_model()
+    try:
+        for i in range(5):
+            model.run(str(tmp_path / f'cell_{i}'), np.array([i, 1.0]))
+    finally:
+        model.close()
+
+    pids = {read_result(tmp_path / f'cell_{i}')[0] for i in range(5)}
+    assert len(pids) == 1
+
+
+def test_worker_is_closed(tmp_path):
+    model = worker_model()
+    model.run(str(tmp_path / 'cell_1'), np.array([1.0, 2.0]))
+    workers = list(model.workers.workers)
+    model.close()
+
+    assert workers and all(not worker.is_alive() for worker in workers)
+
+
+def test_stuck_worker_is_replaced(tmp_path):
+    model = worker_model(timeout=1)
+    try:
+        model.run(str(tmp_path / 'cell_1'), np.array([-1.0, 2.0]))
+        model.run(str(tmp_path / 'cell_2'), np.array([1.0, 2.0]))
+    finally:
+        model.close()
+
+    assert (tmp_path / 'cell_1' / 'returncode.txt').read_text() == '-9\n'
+    assert not (tmp_path / 'cell_1' / 'result.txt').exists()
+    assert (tmp_path / 'cell_2' / 'returncode.txt').read_text() == '0\n'
+    assert float(read_result(tmp_path / 'cell_2')[1]) == 3.0
@@ -0,0 +1,62 @@
+import sys
+import pathlib
+
+sys.path.append(str(pathlib.Path(__file__).parents[2]))
+import src.workspace as workspace
+import pytest
+import time
+
+
+@pytest.fixture
+def base(tmp_path) -> pathlib.Path:
+    base = tmp_path / 'base'
+    (base / 'sub').mkdir(parents=True)
+    (base / 'init.mat').write_text('init')
+    (base / 'sub' / 'params.txt').write_text('params')
+    return base
+
+
+@pytest.mark.parametrize('strategy', workspace.STRATEGIES)
+def test_workspace_has_base_files(tmp_path, base, strategy):
+    cell = tmp_path / 'cell_1'
+    workspace.create(str(base), str(cell), strategy)
+
+    assert (cell / 'init.mat').read_text() == 'init'
+    assert (cell / 'sub' / 'params.txt').read_text() == 'params'
+
+
+@pytest.mark.parametrize('strategy', workspace.STRATEGIES)
+def test_workspace_outputs(tmp_path, base, strategy):
+    cell = tmp_path / 'cell_1'
+    workspace.create(str(base), str(cell), strategy)
+    (cell / 'res.mat').write_text('result')
+    (cell / 'cmd.txt').write_text('model')
+
+    assert workspace.outputs(str(base), str(cell), ['cmd.txt']) == ['res.mat']
+
+
+@pytest.mark.parametrize('strategy', [workspace.SYMLINK_TREE, workspace.OVERLAY])
+def test_workspace_writes_into_base(tmp_path, base, strategy, capsys):
+    cell = tmp_path / 'cell_1'
+    workspace.create(str(base), str(cell), strategy)
+    # file system timestamps might be coarse
+    time.sleep(0.1)
+    (cell / 'sub' / 'params.txt').write_text('rewritten')
+    (cell / 'res.mat').write_text('result')
+
+    # in-place write goes into the base, it is an output and warned about
+    assert (base / 'sub' / 'params.txt').read_text() == 'rewritten'
+    assert workspace.outputs(str(base), str(cell)) == ['res.mat', 'sub/params.txt']
+    workspace.record_outputs(str(base), str(cell))
+    assert (cell / workspace.OUTPUTS_FILE).read_text() == 'res.mat\nsub/params.txt\n'
+    assert 'sub/params.txt' in capsys.readouterr().out
+
+
+def test_overlay_new_file_in_linked_directory(tmp_path, base):
+    cell = tmp_path / 'cell_1'
+    workspace.create(str(base), str(cell), workspace.OVERLAY)
+    time.sleep(0.1)
+    (cell / 'sub' / 'res.mat').write_text('result')
+
+    assert (base / 'sub' / 'res.mat').exists()
+    assert workspace.outputs(str(base), str(cell)) == ['sub/res.mat']
@@ -0,0 +1,36 @@
+import pathlib
+import subprocess
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).parents[2]
+CONFIG = ROOT / 'tests' / 'test_run_job' / 'test_config.yaml'
+HEAVY = ['scipy', 'scimath', 'traits']
+
+# Runs POMtool in new interpreter and prints the heavy modules that were imported
+SCRIPT = f'''
+import sys
+sys.path.insert(0, {str(ROOT)!r})
+sys.argv = ['POMtool.py'] + sys.argv[1:]
+from src.main import run
+run()
+print(sorted({{name.split('.')[0] for name in sys.modules}} & set({HEAVY!r})))
+'''
+
+
+def run_pomtool(tmp_path, *args) -> tuple[str, float]:
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', SCRIPT, *args], cwd=tmp_path, capture_output=True, text=True, check=True)
+    return result.stdout.splitlines()[-1], time.perf_counter() - start
+
+
+def test_merge_dry_does_not_import_heavy_modules(tmp_path):
+    imported, elapsed = run_pomtool(tmp_path, 'merge', '--dry', '--skip-calibration', '--config', str(CONFIG), '--patch_count', '2')
+    assert imported == '[]'
+    # generous, importing scipy and scimath alone takes about a second
+    assert elapsed < 5.0
+
+
+def test_run_dry_does_not_import_units(tmp_path):
+    imported, _ = run_pomtool(tmp_path, 'run', '--dry', '--silent', '--skip-calibration', '--config', str(CONFIG))
+    assert 'scimath' not in imported and 'traits' not in imported